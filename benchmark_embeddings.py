@@ -0,0 +1,80 @@
+"""Compare query throughput of embedder backends.
+
+Usage:
+    python benchmark_embeddings.py [backend ...]
+
+Backends are the MEMORY_EMBEDDER names, e.g. stella-cpu stella-onnx. When
+stella-onnx is compared with another Stella backend, a parity check of
+their embeddings is printed as well.
+"""
+
+import sys
+import time
+
+from src.memory_embeddings.embedder_factory import create_embedder
+from src.memory_embeddings.onnx_embeddings import parity_report
+
+QUERIES = [
+    f"{subject} {question}"
+    for subject in [
+        "stress",
+        "green tea",
+        "the gym",
+        "favorite band",
+        "John's birthday",
+        "the movies",
+        "programming in python",
+        "a trip to Paris",
+    ]
+    for question in [
+        "what do I know about it?",
+        "when did we last talk about this?",
+        "how does the user feel about it?",
+        "any plans related to it?",
+    ]
+]
+
+
+def benchmark(embedder, queries, repeats=3):
+    embedder.embed_queries(queries[:4])  # Warm up
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            embedder.embed_query(query)
+    single_qps = repeats * len(queries) / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        embedder.embed_queries(queries)
+    batch_qps = repeats * len(queries) / (time.perf_counter() - start_time)
+    return single_qps, batch_qps
+
+
+def main():
+    backends = sys.argv[1:] or ["stella-cpu", "stella-onnx"]
+    embedders = {}
+    for name in backends:
+        embedders[name] = create_embedder(name)
+        single_qps, batch_qps = benchmark(embedders[name], QUERIES)
+        print(
+            f"{name}: {single_qps:.1f} queries/s one at a time, {batch_qps:.1f} queries/s batched"
+        )
+
+    reference = next(
+        (
+            embedders[name]
+            for name in backends
+            if name.startswith("stella") and name != "stella-onnx"
+        ),
+        None,
+    )
+    if reference is not None and "stella-onnx" in embedders:
+        print(
+            "Parity with reference:",
+            parity_report(reference, embedders["stella-onnx"], QUERIES),
+        )
+
+
+if __name__ == "__main__":
+    main()
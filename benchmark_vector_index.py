@@ -0,0 +1,65 @@
+"""Compare the speed and recall of the vector indexes on the local memory store.
+
+Usage:
+    python benchmark_vector_index.py [dims ...]
+
+Loads memories.yaml with the configured MEMORY_EMBEDDER and reports, for
+each index and each Matryoshka prefix size (default 64 128 256 512),
+queries per second and recall@10 against exact search.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from benchmark_embeddings import QUERIES
+from src.memory_utils.server_memory_manager import ServerMemoryManager
+from src.memory_utils.vector_index import create_vector_index, measure_recall
+
+
+def benchmark(index, queries, k=10, repeats=5):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for query in queries:
+            index.search(query, k)
+    qps = repeats * len(queries) / (time.perf_counter() - start_time)
+    return qps, measure_recall(index, queries, k)
+
+
+def main():
+    dims_list = [int(dims) for dims in sys.argv[1:]] or [64, 128, 256, 512]
+    manager = ServerMemoryManager(vector_index="exact")
+    try:
+        slots = np.flatnonzero(manager.vector_index.live.view())
+        if not len(slots):
+            print("The memory store is empty, add memories before benchmarking")
+            return
+        queries = manager.embed_queries(QUERIES)
+        print(
+            f"{len(slots)} memories, {manager.embeddings.dim} dimensions, {len(queries)} queries"
+        )
+
+        configs = [
+            ("exact", {}),
+            ("ivf", {}),
+            ("float16", {}),
+            ("int8", {}),
+            ("binary", {}),
+        ]
+        configs += [("matryoshka", {"dims": dims}) for dims in dims_list]
+        for name, params in configs:
+            index = create_vector_index(name, manager.embeddings, **params)
+            for slot in slots:
+                index.add(slot)
+            if index.needs_training():
+                index.train()
+            qps, recall = benchmark(index, queries)
+            label = f"{name} {params['dims']}" if params else name
+            print(f"{label}: {qps:.1f} queries/s, recall@10 {recall:.3f}")
+    finally:
+        manager.close()
+
+
+if __name__ == "__main__":
+    main()
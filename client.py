@@ -68,6 +68,10 @@ class MemoryClient:
         response = requests.get(url, params=params)
         return response.json()
 
+    def count_memories(self):
+        response = requests.get(f"{self.base_url}/stats")
+        return response.json()["memory_count"]
+
     def generate_ai_context(self, messages, system_message, human_actor, ai_actor):
         # Detect actors from conversation if possible
         if messages and len(messages) > 0:
@@ -355,6 +359,4 @@ if __name__ == "__main__":
     # test_main()
 
     client = MemoryClient()
-    memories = client.search_memories("")
-    print("Number of memories:", len(memories))
-    print(memories)
+    print("Number of memories:", client.count_memories())
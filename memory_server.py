@@ -1,14 +1,24 @@
+import math
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 import logging
 from waitress import serve
 
 import time
 
+from src.memory_utils.attribute_columns import AttributeColumns, to_epoch, to_float
+from src.memory_utils.response_encoding import (
+    JSON_MIMETYPE,
+    encode,
+    NDJSON_MIMETYPE,
+    parse_fields,
+    project,
+    project_all,
+    supported_mimetypes,
+)
 from src.memory_utils.server_memory_manager import ServerMemoryManager
 
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -23,8 +33,168 @@ load_dotenv()
 
 app = Flask(__name__)
 
+
+def get_vector_index_params(vector_index):
+    """Constructor options of the two-stage indexes, from the environment."""
+    params = {}
+    if vector_index in ("float16", "int8", "binary", "matryoshka"):
+        params["rescore_factor"] = int(os.getenv("MEMORY_RESCORE_FACTOR", 4))
+    if vector_index == "matryoshka":
+        params["dims"] = int(os.getenv("MEMORY_MATRYOSHKA_DIMS", 256))
+    return params
+
+
+def parse_score_weights(value):
+    """Weights like "importance=0.1,recency=0.05" as a dict."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
 # Initialize the memory manager
-memory_manager = ServerMemoryManager()
+vector_index = os.getenv("MEMORY_VECTOR_INDEX", "ivf")
+memory_manager = ServerMemoryManager(
+    vector_index=vector_index,
+    vector_index_params=get_vector_index_params(vector_index),
+    query_cache_size=int(os.getenv("MEMORY_QUERY_CACHE_SIZE", 4096)),
+    async_embedding=os.getenv("MEMORY_ASYNC_EMBEDDING", "true").lower()
+    in ("1", "true", "yes"),
+    coalesce_searches=os.getenv("MEMORY_COALESCE_SEARCHES", "true").lower()
+    in ("1", "true", "yes"),
+    search_max_wait=float(os.getenv("MEMORY_SEARCH_MAX_WAIT_MS", 3)) / 1000,
+    mmap_embeddings=os.getenv("MEMORY_MMAP_EMBEDDINGS", "true").lower()
+    in ("1", "true", "yes"),
+    score_weights=parse_score_weights(os.getenv("MEMORY_SCORE_WEIGHTS", "")),
+    recency_half_life=float(os.getenv("MEMORY_RECENCY_HALF_LIFE_DAYS", 30)) * 86400,
+    track_access=os.getenv("MEMORY_TRACK_ACCESS", "true").lower()
+    in ("1", "true", "yes"),
+)
+
+
+def get_search_params(args):
+    """Vector index knobs shared by the search endpoints."""
+    search_params = {}
+    if args.get("nprobe") is not None:
+        search_params["nprobe"] = int(args["nprobe"])
+    if args.get("rescore_factor") is not None:
+        search_params["rescore_factor"] = int(args["rescore_factor"])
+    if str(args.get("exact", "")).lower() in ("1", "true", "yes"):
+        search_params["exact"] = True
+    return search_params
+
+
+def get_score_cutoffs(args):
+    """Score thresholds that let a search return fewer than k memories."""
+    cutoffs = {}
+    for name in ("min_score", "min_relative_score"):
+        if args.get(name) is not None:
+            cutoffs[name] = float(args[name])
+    return cutoffs
+
+
+def get_score_weights(args):
+    """Re-ranking weights given as weight_<name> arguments, None for the defaults.
+
+    Unparsable weights are NaN, which validate_weights rejects.
+    """
+    weights = {
+        name: to_float(args[f"weight_{name}"])
+        for name in AttributeColumns.SCORE_WEIGHTS
+        if args.get(f"weight_{name}") is not None
+    }
+    return weights or None
+
+
+def validate_weights(weights):
+    """Error message for malformed re-ranking weights, or None."""
+    if weights is None:
+        return None
+    if not isinstance(weights, dict):
+        return "'weights' must be an object"
+    unknown = set(weights) - set(AttributeColumns.SCORE_WEIGHTS)
+    if unknown:
+        return f"Unknown score weights: {', '.join(sorted(unknown))}"
+    for name, weight in weights.items():
+        if not math.isfinite(to_float(weight)):
+            return f"Score weight '{name}' must be a finite number"
+    return None
+
+
+def get_result_fields(fields):
+    """Projected fields of search hits, which always keep their score."""
+    fields = parse_fields(fields)
+    return None if fields is None else fields + ["score"]
+
+
+def respond(data, status=200):
+    """Encode data as msgpack if the client accepts it, else as compact JSON."""
+    mimetype = request.accept_mimetypes.best_match(
+        supported_mimetypes(), default=JSON_MIMETYPE
+    )
+    return Response(encode(data, mimetype), status=status, mimetype=mimetype)
+
+
+def get_search_filters(args):
+    """Attribute filters of /search_memories, see AttributeColumns.mask.
+
+    ai_persona, source, tag and emotional_tag may be repeated to accept
+    several values.
+    """
+    filters = {}
+    for name, arg in (
+        ("ai_persona", "ai_persona"),
+        ("source", "source"),
+        ("tags", "tag"),
+        ("emotional_tags", "emotional_tag"),
+    ):
+        values = args.getlist(arg)
+        if values:
+            filters[name] = values
+    for name in ("since", "until", "min_importance"):
+        if args.get(name) is not None:
+            filters[name] = args[name]
+    if "tags" in filters:
+        filters["tag_match"] = args.get("match", "any")
+    return filters
+
+
+def validate_filters(filters):
+    """Error message for malformed search filters, or None."""
+    if not isinstance(filters, dict):
+        return "'filters' must be an object"
+    unknown = set(filters) - set(AttributeColumns.FILTERS)
+    if unknown:
+        return f"Unknown filters: {', '.join(sorted(unknown))}"
+    if filters.get("tag_match", "any") not in ("any", "all"):
+        return "'match' must be 'any' or 'all'"
+    for name in ("ai_persona", "source"):
+        values = filters.get(name)
+        if values is not None and not (
+            isinstance(values, str) or is_list_of(values, str)
+        ):
+            return f"'{name}' must be a string or a list of strings"
+    # A string would be matched one character at a time
+    for name in ("tags", "emotional_tags"):
+        values = filters.get(name)
+        if values is not None and not is_list_of(values, (str, dict)):
+            return f"'{name}' must be a list of tags"
+    # Unparsable values would compare as NaN and silently match nothing
+    for name in ("since", "until"):
+        if filters.get(name) is not None and math.isnan(to_epoch(filters[name])):
+            return f"'{name}' must be an ISO timestamp or epoch seconds"
+    if filters.get("min_importance") is not None and math.isnan(
+        to_float(filters["min_importance"])
+    ):
+        return "'min_importance' must be a number"
+    return None
+
+
+def is_list_of(values, types):
+    return isinstance(values, list) and all(
+        isinstance(value, types) for value in values
+    )
 
 
 @app.route("/add_memory", methods=["POST"])
@@ -40,18 +210,90 @@ def add_memory():
 
         end_time = time.time()
         logger.info(f"add_memory operation took {end_time - start_time:.4f} seconds")
-        return jsonify({"message": "Memory added successfully", "id": memory_id}), 201
+        return (
+            jsonify(
+                {
+                    "message": "Memory added successfully",
+                    "id": memory_id,
+                    "status": memory_manager.memory_status(memory_id),
+                }
+            ),
+            201,
+        )
     except Exception as e:
         logger.exception("Error in add_memory")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/add_memories", methods=["POST"])
+def add_memories():
+    start_time = time.time()
+    try:
+        data = request.json
+        if not isinstance(data, list):
+            return jsonify({"error": "Expected a list of memories"}), 400
+        if not all(isinstance(item, dict) and "topic" in item for item in data):
+            return jsonify({"error": "Missing 'topic' in request"}), 400
+
+        memory_ids = memory_manager.add_many(data)
+
+        end_time = time.time()
+        logger.info(
+            f"add_memories operation for {len(memory_ids)} memories took {end_time - start_time:.4f} seconds"
+        )
+        return (
+            jsonify({"message": "Memories added successfully", "ids": memory_ids}),
+            201,
+        )
+    except Exception as e:
+        logger.exception("Error in add_memories")
+        return jsonify({"error": str(e)}), 500
+
+
+def stream_memories(tags, match, cursor, fields):
+    """NDJSON lines of the matching memories, produced while the response is sent."""
+    for memory in memory_manager.iter_memories(tags, match=match, cursor=cursor):
+        yield encode(project(memory, fields)) + b"\n"
+
+
 @app.route("/retrieve_memories", methods=["GET"])
 def retrieve_memories():
+    """Memories with any or all of the tags, every memory without tags.
+
+    With a limit or cursor one page is returned together with the cursor of
+    the next, and with stream=true (or Accept: application/x-ndjson) the
+    memories are streamed as one JSON object per line. Otherwise they are
+    returned as one list.
+    """
     try:
         tags = request.args.getlist("tag")
-        filtered_memories = memory_manager.filter_by_tags(tags)
-        return jsonify(filtered_memories), 200
+        match = request.args.get("match", "any")
+        if match not in ("any", "all"):
+            return jsonify({"error": "'match' must be 'any' or 'all'"}), 400
+        fields = parse_fields(request.args.getlist("fields"))
+        try:
+            cursor = int(request.args.get("cursor", 0))
+            limit = request.args.get("limit")
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            return jsonify({"error": "'cursor' and 'limit' must be integers"}), 400
+        if cursor < 0 or (limit is not None and limit < 1):
+            return jsonify({"error": "Invalid 'cursor' or 'limit'"}), 400
+
+        stream = str(request.args.get("stream", "")).lower() in ("1", "true", "yes")
+        if stream or request.accept_mimetypes.best == NDJSON_MIMETYPE:
+            return Response(
+                stream_memories(tags, match, cursor, fields), mimetype=NDJSON_MIMETYPE
+            )
+        if limit is not None or "cursor" in request.args:
+            memories, next_cursor = memory_manager.list_memories(
+                tags, match=match, cursor=cursor, limit=limit or 100
+            )
+            return respond(
+                {"memories": project_all(memories, fields), "next_cursor": next_cursor}
+            )
+        filtered_memories = memory_manager.filter_by_tags(tags, match=match)
+        return respond(project_all(filtered_memories, fields))
     except Exception as e:
         logger.exception("Error in retrieve_memories")
         return jsonify({"error": str(e)}), 500
@@ -85,13 +327,111 @@ def search_memories():
     try:
         query = request.args.get("q", "").lower()
         k = int(request.args.get("k", 10))  # Default to 10 if not specified
-        results = memory_manager.search(query, k=k)
-        return jsonify(results), 200
+        mode = request.args.get("mode", "vector")
+        if mode not in memory_manager.SEARCH_MODES:
+            return (
+                jsonify({"error": "'mode' must be 'vector', 'hybrid' or 'lexical'"}),
+                400,
+            )
+        filters = get_search_filters(request.args)
+        weights = get_score_weights(request.args)
+        error = validate_filters(filters) or validate_weights(weights)
+        if error:
+            return jsonify({"error": error}), 400
+        results = memory_manager.search(
+            query,
+            k=k,
+            mode=mode,
+            filters=filters,
+            weights=weights,
+            **get_score_cutoffs(request.args),
+            **get_search_params(request.args),
+        )
+        fields = get_result_fields(request.args.getlist("fields"))
+        return respond(project_all(results, fields))
     except Exception as e:
         logger.exception("Error in search_memories")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/search_memories_batch", methods=["POST"])
+def search_memories_batch():
+    try:
+        data = request.json
+        if not data or not isinstance(data.get("queries"), list):
+            return jsonify({"error": "Missing 'queries' list in request"}), 400
+        queries = [str(query).lower() for query in data["queries"]]
+        k = int(data.get("k", 10))
+        mode = data.get("mode", "vector")
+        if mode not in memory_manager.SEARCH_MODES:
+            return (
+                jsonify({"error": "'mode' must be 'vector', 'hybrid' or 'lexical'"}),
+                400,
+            )
+        filters = data.get("filters") or {}
+        weights = data.get("weights")
+        error = validate_filters(filters) or validate_weights(weights)
+        if error:
+            return jsonify({"error": error}), 400
+        if weights is not None:
+            weights = {name: float(weight) for name, weight in weights.items()}
+        results = memory_manager.search_batch(
+            queries,
+            k=k,
+            merge=bool(data.get("merge", False)),
+            mode=mode,
+            filters=filters,
+            weights=weights,
+            **get_score_cutoffs(data),
+            **get_search_params(data),
+        )
+        fields = get_result_fields(data.get("fields"))
+        results = {
+            key: (
+                [project_all(memories, fields) for memories in value]
+                if key == "results"
+                else project_all(value, fields)
+            )
+            for key, value in results.items()
+        }
+        return respond(results)
+    except Exception as e:
+        logger.exception("Error in search_memories_batch")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route("/memory_status/<memory_id>", methods=["GET"])
+def memory_status(memory_id):
+    status = memory_manager.memory_status(memory_id)
+    if status is None:
+        return jsonify({"error": "Memory not found"}), 404
+    return jsonify({"id": memory_id, "status": status}), 200
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    try:
+        stats = {
+            "memory_count": memory_manager.memory_count,
+            "query_cache": memory_manager.query_cache.stats(),
+            "pending_embeddings": len(memory_manager.pending_ids),
+            "failed_embeddings": len(memory_manager.failed_ids),
+            "pending_access_stats": len(memory_manager.pending_access),
+        }
+        # Recall is measured on demand since it runs exact searches
+        if str(request.args.get("recall", "")).lower() in ("1", "true", "yes"):
+            k = int(request.args.get("k", 10))
+            stats[f"recall@{k}"] = memory_manager.measure_recall(
+                int(request.args.get("sample", 100)),
+                k,
+                **get_search_params(request.args),
+            )
+        return jsonify(stats), 200
+    except Exception as e:
+        logger.exception("Error in stats")
+        return jsonify({"error": str(e)}), 500
+
+
 if __name__ == "__main__":
     try:
         port = int(os.getenv("SERVER_PORT", 17174))
@@ -99,3 +439,6 @@ if __name__ == "__main__":
         serve(app, host="0.0.0.0", port=port)
     except Exception as e:
         logger.exception(f"Unhandled exception in main: {str(e)}")
+    finally:
+        # Marks the embedding file as safe to map on the next start
+        memory_manager.close()
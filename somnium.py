@@ -69,10 +69,10 @@ class Somnium:
             yaml.dump(archived_memories, f)
 
     def save_active_memories(self, active_memories: List[Dict]):
-        """Save active memories to memories.yaml."""
-        with open("memories.yaml", "w") as f:
-            yaml.dump(active_memories, f)
-        pass  # TODO: Implement this
+        """Save active memories as a new snapshot of the memory store."""
+        # Writing memories.yaml directly would be undone by the write-ahead
+        # log replay on the next start, so go through the memory manager
+        self.memory_manager.save()
 
     def extract_tags(self, from_timestamp: Optional[datetime] = None):
         """Main method to analyze memories and extract relevant tags using LLM."""
@@ -124,7 +124,8 @@ class Somnium:
             try:
                 tags = json.loads(response["choices"][0]["message"]["content"])
                 tags = [tag.replace("_", " ").lower().strip() for tag in tags]
-                memory["tags"] = tags
+                # Update through the manager so the tag postings stay current
+                self.memory_manager.update(memory["id"], {"tags": tags})
                 tagged_memories.append(memory)
             except (KeyError, IndexError) as e:
                 print(f"Error processing memory {memory.get('id', 'unknown')}: {e}")
@@ -140,6 +141,8 @@ class Somnium:
 
 
 def main():
+    # Fails if the memory server has the store open: both would rotate the
+    # same write-ahead log, so Somnium runs while the server is stopped
     memory_manager = ServerMemoryManager()
     openai_client = OpenAIClient(api_key="", base_url="http://127.0.0.1:17173")
 
@@ -147,6 +150,7 @@ def main():
     results = dream_manager.dream()
 
     print(f"Total memories processed: {results['total_memories']}")
+    memory_manager.close()
 
 
 if __name__ == "__main__":
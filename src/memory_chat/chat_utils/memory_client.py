@@ -6,12 +6,28 @@ import re
 
 from amp_lib import OpenAIClient
 
+from src.memory_utils.response_encoding import (
+    MSGPACK_IMPORT_SUCCESS,
+    MSGPACK_MIMETYPE,
+    decode,
+)
+
 
 class MemoryClient:
     def __init__(self, base_url="http://127.0.0.1:17174"):
         self.base_url = base_url
+        # Search and retrieve responses are smaller and faster to decode as msgpack
+        self.read_headers = (
+            {"Accept": f"{MSGPACK_MIMETYPE}, application/json;q=0.9"}
+            if MSGPACK_IMPORT_SUCCESS
+            else {}
+        )
 
-    def add_memory(
+    def _decode(self, response):
+        mimetype = response.headers.get("Content-Type", "").split(";")[0].strip()
+        return decode(response.content, mimetype)
+
+    def _memory_data(
         self,
         topic,
         content,
@@ -26,9 +42,7 @@ class MemoryClient:
         emotional_valence=None,
         emotional_tags=None,
     ):
-        start_time = time.time()
-        url = f"{self.base_url}/add_memory"
-        data = {
+        return {
             "topic": topic,
             "content": content,
             "ai_persona": ai_persona,
@@ -42,17 +56,105 @@ class MemoryClient:
             "emotional_valence": emotional_valence or {},
             "emotional_tags": emotional_tags or [],
         }
+
+    def add_memory(
+        self,
+        topic,
+        content,
+        ai_persona=None,
+        tags=None,
+        source=None,
+        confidence=None,
+        importance=None,
+        context=None,
+        related_memories=None,
+        metadata=None,
+        emotional_valence=None,
+        emotional_tags=None,
+    ):
+        start_time = time.time()
+        url = f"{self.base_url}/add_memory"
+        data = self._memory_data(
+            topic,
+            content,
+            ai_persona=ai_persona,
+            tags=tags,
+            source=source,
+            confidence=confidence,
+            importance=importance,
+            context=context,
+            related_memories=related_memories,
+            metadata=metadata,
+            emotional_valence=emotional_valence,
+            emotional_tags=emotional_tags,
+        )
         response = requests.post(url, json=data)
         end_time = time.time()
         print(f"add_memory request took {end_time - start_time:.4f} seconds")
         return response.json()
 
-    def retrieve_memories(self, tags=None):
-        url = f"{self.base_url}/retrieve_memories"
-        params = {"tag": tags} if tags else None
-        response = requests.get(url, params=params)
+    def add_memories(self, memories):
+        """Add several memories in one request.
+
+        Args:
+            memories: List of dicts with the keyword arguments of add_memory
+
+        Returns:
+            dict: Server response with the ids of the new memories
+        """
+        start_time = time.time()
+        url = f"{self.base_url}/add_memories"
+        data = [self._memory_data(**memory) for memory in memories]
+        response = requests.post(url, json=data)
+        end_time = time.time()
+        print(
+            f"add_memories request for {len(data)} memories took {end_time - start_time:.4f} seconds"
+        )
         return response.json()
 
+    def retrieve_memories(self, tags=None, match="any", fields=None):
+        url = f"{self.base_url}/retrieve_memories"
+        params = {"tag": tags, "match": match} if tags else {}
+        if fields:
+            params["fields"] = ",".join(fields)
+        response = requests.get(url, params=params, headers=self.read_headers)
+        return self._decode(response)
+
+    def retrieve_memories_page(
+        self, tags=None, match="any", fields=None, cursor=0, limit=100
+    ):
+        """Fetch one page of memories.
+
+        Returns:
+            dict: "memories" and the "next_cursor" to pass for the next page,
+            None after the last one
+        """
+        url = f"{self.base_url}/retrieve_memories"
+        params = {"cursor": cursor, "limit": limit}
+        if tags:
+            params.update({"tag": tags, "match": match})
+        if fields:
+            params["fields"] = ",".join(fields)
+        response = requests.get(url, params=params, headers=self.read_headers)
+        return self._decode(response)
+
+    def iter_memories(self, tags=None, match="any", fields=None):
+        """Yield every matching memory from a streamed response, one line at a time."""
+        url = f"{self.base_url}/retrieve_memories"
+        params = {"stream": "true"}
+        if tags:
+            params.update({"tag": tags, "match": match})
+        if fields:
+            params["fields"] = ",".join(fields)
+        with requests.get(url, params=params, stream=True) as response:
+            for line in response.iter_lines():
+                if line:
+                    yield decode(line)
+
+    def count_memories(self):
+        response = requests.get(f"{self.base_url}/stats")
+        return response.json()["memory_count"]
+
     def update_memory(self, memory_id, data):
         url = f"{self.base_url}/update_memory/{memory_id}"
         response = requests.put(url, json=data)
@@ -63,11 +165,98 @@ class MemoryClient:
         response = requests.delete(url)
         return response.json()
 
-    def search_memories(self, query, k=10):
+    def search_memories(
+        self,
+        query,
+        k=10,
+        nprobe=None,
+        exact=False,
+        mode="vector",
+        filters=None,
+        fields=None,
+        min_score=None,
+        min_relative_score=None,
+        weights=None,
+    ):
+        """Search memories by "vector" similarity, "lexical" BM25 or a "hybrid" of both.
+
+        Every hit carries its "score". Hits below min_score, or below
+        min_relative_score times the best score, are left out. weights,
+        e.g. {"importance": 0.1, "recency": 0.05}, re-rank the hits by
+        attributes as well as similarity instead of the server defaults;
+        the score and thresholds are then the weighted score.
+
+        Args:
+            filters: Optional dict restricting the search, with any of
+                ai_persona, source, tags, tag_match ("any" or "all"),
+                emotional_tags, since, until (ISO timestamps) and
+                min_importance
+            fields: Optional list of the memory fields to return, e.g.
+                ["content", "context.explanation"]; all fields by default
+        """
         url = f"{self.base_url}/search_memories"
-        params = {"q": query, "k": k}
-        response = requests.get(url, params=params)
-        return response.json()
+        params = {"q": query, "k": k, "mode": mode}
+        if nprobe is not None:
+            params["nprobe"] = nprobe
+        if exact:
+            params["exact"] = "true"
+        # The endpoint takes the filters as query arguments
+        arg_names = {
+            "tags": "tag",
+            "tag_match": "match",
+            "emotional_tags": "emotional_tag",
+        }
+        for name, value in (filters or {}).items():
+            if value is not None:
+                params[arg_names.get(name, name)] = value
+        if fields:
+            params["fields"] = ",".join(fields)
+        if min_score is not None:
+            params["min_score"] = min_score
+        if min_relative_score is not None:
+            params["min_relative_score"] = min_relative_score
+        for name, weight in (weights or {}).items():
+            params[f"weight_{name}"] = weight
+        response = requests.get(url, params=params, headers=self.read_headers)
+        return self._decode(response)
+
+    def search_memories_batch(
+        self,
+        queries,
+        k=10,
+        merge=False,
+        nprobe=None,
+        exact=False,
+        mode="vector",
+        filters=None,
+        fields=None,
+        min_score=None,
+        min_relative_score=None,
+        weights=None,
+    ):
+        """Search several queries in one request, with the options of search_memories.
+
+        Returns:
+            dict: "results" with one list of memories per query, plus a
+            de-duplicated "merged" list when merge is set
+        """
+        url = f"{self.base_url}/search_memories_batch"
+        data = {
+            "queries": queries,
+            "k": k,
+            "merge": merge,
+            "exact": exact,
+            "mode": mode,
+            "filters": filters or {},
+            "fields": fields,
+            "min_score": min_score,
+            "min_relative_score": min_relative_score,
+            "weights": weights,
+        }
+        if nprobe is not None:
+            data["nprobe"] = nprobe
+        response = requests.post(url, json=data, headers=self.read_headers)
+        return self._decode(response)
 
     def generate_ai_context(self, messages, system_message, human_actor, ai_actor):
         # Detect actors from conversation if possible
@@ -158,6 +347,29 @@ Provide a concise memory summary that explains the nature of this last communica
         open_ai_client: OpenAIClient,
         model_name: str,
     ):
+        return self.add_memory(
+            **self.llm_parse_memory_from_conversation(
+                messages,
+                system_message,
+                human_actor,
+                ai_actor,
+                ai_persona,
+                open_ai_client,
+                model_name,
+            )
+        )
+
+    def llm_parse_memory_from_conversation(
+        self,
+        messages,
+        system_message,
+        human_actor,
+        ai_actor,
+        ai_persona,
+        open_ai_client: OpenAIClient,
+        model_name: str,
+    ):
+        """Build the add_memory arguments for a conversation without sending them."""
         # Combine messages into a conversation format
         conversation = "\n".join(
             [f"{msg['role']}: {msg['content']}" for msg in messages]
@@ -212,19 +424,18 @@ Respond only with YAML, no other text."""
         emotional_valence = self._parse_emotional_valence(
             yaml_response.get("emotional_valence", {})
         )
-        # Add the memory using the parsed YAML data
-        return self.add_memory(
-            topic=yaml_response.get("content", ""),
-            content=messages[-1]["content"],
-            tags=yaml_response.get("tags", []),
-            source="conversation",
-            confidence=yaml_response.get("confidence"),
-            importance=yaml_response.get("importance"),
-            context={
+        return {
+            "topic": yaml_response.get("content", ""),
+            "content": messages[-1]["content"],
+            "tags": yaml_response.get("tags", []),
+            "source": "conversation",
+            "confidence": yaml_response.get("confidence"),
+            "importance": yaml_response.get("importance"),
+            "context": {
                 "explanation": context,
                 "perspective": yaml_response.get("context"),
             },
-            emotional_valence=emotional_valence,
-            emotional_tags=yaml_response.get("emotional_tags", []),
-            ai_persona=ai_persona,
-        )
+            "emotional_valence": emotional_valence,
+            "emotional_tags": yaml_response.get("emotional_tags", []),
+            "ai_persona": ai_persona,
+        }
@@ -8,7 +8,7 @@ class MemoryFinder:
 
     def find_memories(self, query: str) -> Optional[str]:
         # Get all potentially relevant memories
-        memories = self.memory_client.search_memories(query, k=5)
+        memories = self.memory_client.search_memories(query, k=5, mode="hybrid")
         return memories if memories else None
 
     def recall_memories(self, conversation_history: List[Dict]) -> Optional[str]:
@@ -62,13 +62,22 @@ User's most recent message:
                 response["choices"][0]["message"]["content"].strip().split("\n")
             )
 
-            # Get memories for each query and combine results
-            all_memories = []
+            search_queries = [query for query in search_queries if query.strip()]
             for query in search_queries:
                 print(f"Search query: {query}")
-                memories = self.find_memories(query)
-                if memories:
-                    all_memories.extend(memories)
+
+            # Search all queries in one request and combine the distinct results.
+            # Hybrid search also catches names and exact terms by BM25
+            all_memories = []
+            if search_queries:
+                all_memories = self.memory_client.search_memories_batch(
+                    search_queries,
+                    k=5,
+                    merge=True,
+                    mode="hybrid",
+                    # All the relevance analysis and the prompt read
+                    fields=["id", "content", "context.explanation", "timestamp"],
+                )["merged"]
 
             # Return combined memories or None if empty
             return all_memories if all_memories else None
@@ -26,28 +26,22 @@ class MemoryThread(QThread):
 
     def run(self):
         try:
-            print("Creating memory from user message")
-            # Create memory from user message
-            self.memory_client.llm_create_memory_from_conversation(
-                messages=self.messages[:-1],
-                system_message=self.system_message,
-                human_actor=self.human_actor,
-                ai_actor=self.ai_actor,
-                ai_persona=self.ai_persona,
-                open_ai_client=self.openai_client,
-                model_name=self.model_name,
-            )
-            print("Memory created from user message")
-            # Create memory from AI response
-            self.memory_client.llm_create_memory_from_conversation(
-                messages=self.messages,
-                system_message=self.system_message,
-                human_actor=self.human_actor,
-                ai_actor=self.ai_actor,
-                ai_persona=self.ai_persona,
-                open_ai_client=self.openai_client,
-                model_name=self.model_name,
-            )
-            print("Memory created from AI response")
+            print("Creating memories from conversation")
+            # Parse memories from the user message and the AI response, then
+            # store both in a single request
+            memories = [
+                self.memory_client.llm_parse_memory_from_conversation(
+                    messages=messages,
+                    system_message=self.system_message,
+                    human_actor=self.human_actor,
+                    ai_actor=self.ai_actor,
+                    ai_persona=self.ai_persona,
+                    open_ai_client=self.openai_client,
+                    model_name=self.model_name,
+                )
+                for messages in (self.messages[:-1], self.messages)
+            ]
+            self.memory_client.add_memories(memories)
+            print("Memories created from user message and AI response")
         except Exception as e:
             print(f"Error creating memory: {e}")
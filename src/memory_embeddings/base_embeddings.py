@@ -0,0 +1,41 @@
+import numpy as np
+
+
+def normalize(vectors):
+    """Scale vectors to unit length so that dot products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class BaseEmbeddings:
+    """Interface shared by the embedding backends.
+
+    Subclasses set model_name and revision, which identify cached
+    embeddings, and implement embed_docs and embed_queries.
+    """
+
+    model_name = None
+    revision = None
+    query_prompt_name = "query"
+
+    @property
+    def model_id(self):
+        return f"{self.model_name}@{self.revision}"
+
+    def embed_docs(self, docs: list[str]):
+        raise NotImplementedError
+
+    def embed_queries(self, queries: list[str]):
+        raise NotImplementedError
+
+    def embed_query(self, query: str):
+        return self.embed_queries([query])[0]
+
+    def similarity(self, query, doc_embeddings, k=3, return_scores=False):
+        scores = normalize(doc_embeddings) @ normalize(query).ravel()
+        # Retrieve the position of the top k results
+        top = np.argsort(-scores, kind="stable")[:k]
+        if return_scores:
+            return top.tolist(), scores[top].tolist()
+        return top.tolist()
@@ -0,0 +1,39 @@
+import os
+
+
+def create_embedder(name=None, num_threads=None):
+    """Create the embedding backend selected by name or the MEMORY_EMBEDDER setting.
+
+    Backends:
+        stella: Stella on CUDA when available, otherwise on CPU
+        stella-cuda: Stella on CUDA
+        stella-cpu: Stella on CPU, using MEMORY_EMBEDDER_THREADS threads if set
+        stella-onnx: int8-quantized Stella on onnxruntime, exported to
+            MEMORY_ONNX_DIR on first use
+        hashing: deterministic feature hashing embedder for tests and CPU-only hosts
+    """
+    name = name or os.getenv("MEMORY_EMBEDDER", "stella")
+    if num_threads is None and os.getenv("MEMORY_EMBEDDER_THREADS"):
+        num_threads = int(os.getenv("MEMORY_EMBEDDER_THREADS"))
+
+    if name == "hashing":
+        from src.memory_embeddings.hashing_embeddings import HashingEmbeddings
+
+        return HashingEmbeddings()
+
+    if name in ("stella", "stella-cuda", "stella-cpu"):
+        # Imported lazily so the hashing backend works without torch installed
+        from src.memory_embeddings.stella_embeddings import StellaEmbeddings
+
+        device = {"stella": None, "stella-cuda": "cuda", "stella-cpu": "cpu"}[name]
+        return StellaEmbeddings(device=device, num_threads=num_threads)
+
+    if name == "stella-onnx":
+        from src.memory_embeddings.onnx_embeddings import OnnxStellaEmbeddings
+
+        return OnnxStellaEmbeddings(
+            export_dir=os.getenv("MEMORY_ONNX_DIR", "onnx_model"),
+            num_threads=num_threads,
+        )
+
+    raise ValueError(f"Unknown embedder: {name}")
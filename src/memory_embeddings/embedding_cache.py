@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Persistent document embedding cache keyed by a hash of the model id and text.
+
+    Vectors live in an append-only flat float32 file that is memory-mapped on
+    load, so opening the cache does not copy the vectors into the process heap.
+    Keys are stored as fixed-width hex digests in a parallel file.
+    """
+
+    KEY_SIZE = 64  # sha256 hex digest
+
+    def __init__(self, model_id: str, cache_dir: str = "embedding_cache"):
+        self.model_id = model_id
+        self.cache_dir = cache_dir
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id)
+        self.base_path = os.path.join(cache_dir, slug)
+        self.meta_path = self.base_path + ".json"
+        self.generation = 0
+        self.dim = None
+        # (key -> row, mapped vectors). Compaction replaces the pair as a
+        # whole, so a lock-free lookup never mixes rows of two generations
+        self.state = ({}, None)
+        # Guards appends and compaction; lookups read self.state as-is
+        self.lock = threading.Lock()
+        self.load()
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def index(self):
+        return self.state[0]
+
+    @property
+    def vectors(self):
+        return self.state[1]
+
+    @property
+    def vectors_path(self):
+        return f"{self.base_path}.{self.generation}.f32"
+
+    @property
+    def keys_path(self):
+        return f"{self.base_path}.{self.generation}.keys"
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        self.generation = meta["generation"]
+        self.dim = meta["dim"]
+        if not os.path.exists(self.vectors_path) or not os.path.exists(self.keys_path):
+            return
+
+        row_size = self.dim * np.dtype(np.float32).itemsize
+        count = min(
+            os.path.getsize(self.keys_path) // self.KEY_SIZE,
+            os.path.getsize(self.vectors_path) // row_size,
+        )
+        # Drop partially written tails left behind by an interrupted append
+        os.truncate(self.vectors_path, count * row_size)
+        os.truncate(self.keys_path, count * self.KEY_SIZE)
+
+        with open(self.keys_path, "rb") as f:
+            data = f.read()
+        index = {
+            data[i * self.KEY_SIZE : (i + 1) * self.KEY_SIZE].decode("ascii"): i
+            for i in range(count)
+        }
+        self.state = (index, self._map_vectors(count))
+
+    def _map_vectors(self, count):
+        if count == 0:
+            return None
+        return np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim)
+        )
+
+    def _write_meta(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "model_id": self.model_id,
+                    "dim": self.dim,
+                    "generation": self.generation,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.meta_path)
+
+    def get(self, key: str):
+        index, vectors = self.state
+        row = index.get(key)
+        if row is None:
+            return None
+        if vectors is None or row >= len(vectors):
+            # Appended after this lookup read the state; appends publish the
+            # longer mapping before the key, so the current state has it
+            vectors = self.state[1]
+        return vectors[row]
+
+    def put_many(self, keys: list[str], vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        with self.lock:
+            self._put_many(keys, vectors)
+
+    def _put_many(self, keys, vectors):
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            self._write_meta()
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}"
+            )
+
+        # Texts repeated in the batch or cached by another thread meanwhile
+        # are written once, so that every row belongs to the key it follows
+        index, mapped = self.state
+        rows = {}
+        for i, key in enumerate(keys):
+            if key not in index:
+                rows.setdefault(key, i)
+        if not rows:
+            return
+        keys = list(rows)
+        vectors = vectors[list(rows.values())]
+
+        # Vectors are appended before keys so that a key never points past
+        # the end of the vector file
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write("".join(keys).encode("ascii"))
+
+        # Map the new rows before any key can point at them
+        count = 0 if mapped is None else len(mapped)
+        self.state = (index, self._map_vectors(count + len(keys)))
+        for i, key in enumerate(keys):
+            index[key] = count + i
+
+    def compact(self, live_keys: list[str], max_dead_ratio: float = 0.5):
+        """Rewrite the cache without stale entries once they dominate the files."""
+        with self.lock:
+            self._compact(live_keys, max_dead_ratio)
+
+    def _compact(self, live_keys, max_dead_ratio):
+        count = 0 if self.vectors is None else len(self.vectors)
+        live_rows = sorted({self.index[k] for k in live_keys if k in self.index})
+        if count == 0 or count - len(live_rows) <= count * max_dead_ratio:
+            return
+
+        rows_to_keys = {row: key for key, row in self.index.items()}
+        keys = [rows_to_keys[row] for row in live_rows]
+        vectors = np.asarray(self.vectors[live_rows])
+        old_vectors_path, old_keys_path = self.vectors_path, self.keys_path
+
+        # Write the new generation first and switch over by replacing the
+        # metadata file, so a crash leaves either the old or the new cache
+        self.generation += 1
+        with open(self.vectors_path, "wb") as f:
+            f.write(vectors.tobytes())
+        with open(self.keys_path, "wb") as f:
+            f.write("".join(keys).encode("ascii"))
+        self._write_meta()
+
+        self.state = (
+            {key: i for i, key in enumerate(keys)},
+            self._map_vectors(len(keys)),
+        )
+        for path in (old_vectors_path, old_keys_path):
+            os.remove(path)
+        logger.info(f"Compacted embedding cache from {count} to {len(keys)} entries")
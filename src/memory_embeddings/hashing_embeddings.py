@@ -0,0 +1,46 @@
+from functools import lru_cache
+import hashlib
+import re
+
+import numpy as np
+
+from src.memory_embeddings.base_embeddings import BaseEmbeddings, normalize
+
+
+@lru_cache(maxsize=65536)
+def _feature(token, dim):
+    digest = int.from_bytes(
+        hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    return digest % dim, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbeddings(BaseEmbeddings):
+    """Tiny deterministic embedder based on signed feature hashing.
+
+    Word unigrams and bigrams are hashed into a fixed number of dimensions.
+    It needs no model download or GPU, so tests and CPU-only hosts can run
+    the full server with it; its results are lexical, not semantic.
+    """
+
+    model_name = "hashing"
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.revision = f"v1-{dim}"
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = re.findall(r"\w+", text.lower())
+        for token in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+            index, sign = _feature(token, self.dim)
+            vector[index] += sign
+        return vector
+
+    def embed_docs(self, docs: list[str]):
+        return normalize(
+            np.array([self._embed(doc) for doc in docs]).reshape(-1, self.dim)
+        )
+
+    def embed_queries(self, queries: list[str]):
+        return self.embed_docs(queries)
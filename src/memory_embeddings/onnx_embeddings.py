@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from src.memory_embeddings.base_embeddings import BaseEmbeddings, normalize
+
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+
+    IMPORT_SUCCESS = True
+except ImportError:
+    IMPORT_SUCCESS = False
+
+logger = logging.getLogger(__name__)
+
+MODEL_FILE = "model_int8.onnx"
+FP32_MODEL_FILE = "model_fp32.onnx"
+DENSE_FILE = "dense.npz"
+EXPORT_FILE = "export.json"
+
+
+def export_onnx_model(export_dir="onnx_model"):
+    """Export the pinned Stella revision to ONNX and quantize it to int8.
+
+    The transformer is exported with dynamic batch and sequence axes and its
+    weights are dynamically quantized to int8. Mean pooling and the dense
+    projection are small and run in NumPy at inference time, so they are
+    saved separately. Needs torch and sentence-transformers; inference does not.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    from src.memory_embeddings.stella_embeddings import StellaEmbeddings
+
+    stella = StellaEmbeddings(device="cpu")
+    model = stella.model
+    transformer, pooling, dense = model[0], model[1], model[2]
+    if not pooling.get_config_dict().get("pooling_mode_mean_tokens"):
+        raise ValueError("Only mean pooling is supported by the ONNX engine")
+
+    os.makedirs(export_dir, exist_ok=True)
+    model.tokenizer.save_pretrained(export_dir)
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.auto_model(
+                input_ids=input_ids, attention_mask=attention_mask
+            ).last_hidden_state
+
+    dummy = model.tokenizer(["Hello world"], return_tensors="pt")
+    fp32_path = os.path.join(export_dir, FP32_MODEL_FILE)
+    dynamic_axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer.auto_model).eval(),
+            (dummy["input_ids"], dummy["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": dynamic_axes,
+                "attention_mask": dynamic_axes,
+                "last_hidden_state": dynamic_axes,
+            },
+            opset_version=17,
+        )
+    quantize_dynamic(
+        fp32_path,
+        os.path.join(export_dir, MODEL_FILE),
+        weight_type=QuantType.QInt8,
+    )
+    os.remove(fp32_path)
+
+    np.savez(
+        os.path.join(export_dir, DENSE_FILE),
+        weight=dense.linear.weight.detach().numpy(),
+        bias=dense.linear.bias.detach().numpy(),
+    )
+    with open(os.path.join(export_dir, EXPORT_FILE), "w") as f:
+        json.dump(
+            {
+                "model_name": stella.model_name,
+                "revision": stella.revision,
+                "query_prompt_name": stella.query_prompt_name,
+                "prompts": model.prompts,
+                "max_seq_length": model.max_seq_length,
+                "pad_token": model.tokenizer.pad_token,
+                "pad_token_id": model.tokenizer.pad_token_id,
+            },
+            f,
+            indent=2,
+        )
+    logger.info(f"Exported int8 ONNX model to {export_dir}")
+
+
+class OnnxStellaEmbeddings(BaseEmbeddings):
+    """Stella inference on an int8-quantized ONNX graph through onnxruntime.
+
+    Meant for CPU-only hosts. The model id carries an "onnx-int8" suffix so
+    that its vectors are cached separately from the reference model's.
+    """
+
+    def __init__(self, export_dir="onnx_model", num_threads=None, batch_size=32):
+        if not IMPORT_SUCCESS:
+            raise ImportError(
+                "The ONNX embedder needs the onnxruntime and tokenizers packages"
+            )
+        if not os.path.exists(os.path.join(export_dir, EXPORT_FILE)):
+            logger.info(f"No ONNX export found in {export_dir}, exporting now")
+            export_onnx_model(export_dir)
+
+        with open(os.path.join(export_dir, EXPORT_FILE), "r") as f:
+            export = json.load(f)
+        self.model_name = export["model_name"]
+        self.revision = f"{export['revision']}+onnx-int8"
+        self.query_prompt_name = export["query_prompt_name"]
+        self.prompts = export["prompts"]
+        self.batch_size = batch_size
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(export["max_seq_length"])
+        self.tokenizer.enable_padding(
+            pad_id=export["pad_token_id"], pad_token=export["pad_token"]
+        )
+
+        dense = np.load(os.path.join(export_dir, DENSE_FILE))
+        self.dense_weight = dense["weight"].T.copy()
+        self.dense_bias = dense["bias"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(export_dir, MODEL_FILE),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+
+    def _encode(self, texts):
+        embeddings = np.zeros((len(texts), len(self.dense_bias)), dtype=np.float32)
+        # Batch texts of similar length together to keep padding small
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        for start in range(0, len(texts), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in batch])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            )
+            hidden = self.session.run(
+                ["last_hidden_state"],
+                {"input_ids": input_ids, "attention_mask": attention_mask},
+            )[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            embeddings[batch] = pooled @ self.dense_weight + self.dense_bias
+        return embeddings
+
+    def embed_docs(self, docs: list[str]):
+        return self._encode(docs)
+
+    def embed_queries(self, queries: list[str]):
+        prompt = self.prompts.get(self.query_prompt_name, "")
+        return self._encode([prompt + query for query in queries])
+
+
+def parity_report(reference, candidate, texts, min_cosine=0.98):
+    """Compare the document embeddings of two embedders on the same texts.
+
+    Returns the mean and minimum cosine similarity between matching vectors
+    and whether the minimum reaches min_cosine.
+    """
+    cosines = np.sum(
+        normalize(reference.embed_docs(texts)) * normalize(candidate.embed_docs(texts)),
+        axis=1,
+    )
+    return {
+        "mean_cosine": float(cosines.mean()),
+        "min_cosine": float(cosines.min()),
+        "passed": bool(cosines.min() >= min_cosine),
+    }
@@ -0,0 +1,56 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class QueryEmbeddingCache:
+    """Bounded LRU cache of query embeddings with an optional time-to-live.
+
+    Keys are the prompt name and the query text with case and whitespace
+    normalized, so that repeated recall queries skip the model entirely.
+    """
+
+    def __init__(self, max_size=4096, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(query, prompt_name):
+        return prompt_name, " ".join(query.lower().split())
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.monotonic() - entry[1] < self.ttl
+            ):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, embedding):
+        embedding.flags.writeable = False
+        with self.lock:
+            self.entries[key] = (embedding, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
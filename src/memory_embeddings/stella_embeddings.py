@@ -1,3 +1,4 @@
+import os
 import warnings
 import logging
 
@@ -6,27 +7,50 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 logging.getLogger("xformers").setLevel(logging.ERROR)
 logging.getLogger("transformers.modeling_utils").setLevel(logging.ERROR)
 
+import torch
 from sentence_transformers import SentenceTransformer
 
+from src.memory_embeddings.base_embeddings import BaseEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+class StellaEmbeddings(BaseEmbeddings):
+    model_name = "dunzhang/stella_en_400M_v5"
+    revision = "2aa5579fcae1c579de199a3866b6e514bbbf5d10"
+    # s2p_query, sentence-to-passage, for queries against documents
+    # s2s_query, sentence-to-sentence, for semantic textual similarity task
+    query_prompt_name = "s2p_query"
+
+    def __init__(self, device=None, num_threads=None):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+
+        config_kwargs = None
+        if device == "cpu":
+            # The model's memory efficient attention and unpadding need xformers on a GPU
+            config_kwargs = {
+                "use_memory_efficient_attention": False,
+                "unpad_inputs": False,
+            }
+            # Default to one thread per physical core rather than per hyperthread
+            torch.set_num_threads(num_threads or max(1, (os.cpu_count() or 2) // 2))
+            logger.info(f"Running Stella on CPU with {torch.get_num_threads()} threads")
 
-class StellaEmbeddings:
-    def __init__(self):
         self.model = SentenceTransformer(
-            "dunzhang/stella_en_400M_v5",
-            revision="2aa5579fcae1c579de199a3866b6e514bbbf5d10",
+            self.model_name,
+            revision=self.revision,
             trust_remote_code=True,
-        ).cuda()
+            device=device,
+            config_kwargs=config_kwargs,
+        )
 
     def embed_docs(self, docs: list[str]):
         return self.model.encode(docs)
 
     def embed_query(self, query: str):
-        # s2p_query, sentence-to-passage, for queries against documents
-        # s2s_query, sentence-to-sentence, for semantic textual similarity task
-        return self.model.encode(query, prompt_name="s2p_query")
-
-    def similarity(self, query, doc_embeddings, k=3):
-        results = self.model.similarity(query, doc_embeddings)
-        # Retrieve the position of the top k results
-        top_k_indices = results.squeeze().argsort(descending=True)[:k].tolist()
-        return top_k_indices
+        return self.model.encode(query, prompt_name=self.query_prompt_name)
+
+    def embed_queries(self, queries: list[str]):
+        return self.model.encode(queries, prompt_name=self.query_prompt_name)
@@ -0,0 +1,296 @@
+import copy
+from datetime import datetime
+
+import numpy as np
+
+from src.memory_utils.segmented import SEGMENT_SIZE, SegmentedArray, SegmentedDict
+from src.memory_utils.tag_index import normalize_all
+
+
+def to_epoch(value):
+    """Seconds since the epoch for an ISO timestamp or a number, NaN if unparsable."""
+    if value is None or value == "":
+        return np.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+class AttributeColumns:
+    """Memory attributes stored as NumPy columns indexed by slot, for filtering
+    and re-ranking.
+
+    Personas and sources are dictionary-encoded, timestamps are epoch floats
+    and the numeric fields are float columns, so a filter is a handful of
+    vectorized comparisons producing a boolean mask over slots, and a
+    weighted score is a few array operations over the candidates. Tags and
+    emotional tags keep a posting set of slots per normalized tag.
+
+    Like the indexes it is handed to readers through snapshot(): columns are
+    segmented arrays and tag postings are split by slot segment, so the next
+    mutation copies only the segments it changes.
+    """
+
+    FILTERS = (
+        "ai_persona",
+        "source",
+        "tags",
+        "tag_match",
+        "emotional_tags",
+        "since",
+        "until",
+        "min_importance",
+    )
+
+    # Weighted by score(); "access" is the log of the access count
+    SCORE_WEIGHTS = ("similarity", "importance", "confidence", "recency", "access")
+
+    # (name, dtype, value of empty slots); persona and source hold codes and
+    # seq the insertion sequence number of the memory, see set()
+    COLUMNS = (
+        ("seq", np.int64, -1),
+        ("persona", np.int32, -1),
+        ("source", np.int32, -1),
+        ("timestamp", np.float64, np.nan),
+        ("last_accessed", np.float64, np.nan),
+        ("importance", np.float32, np.nan),
+        ("confidence", np.float32, np.nan),
+        ("access_count", np.float32, np.nan),
+    )
+
+    def __init__(self, segment_size=SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.columns = {
+            name: SegmentedArray(dtype, fill, segment_size=segment_size)
+            for name, dtype, fill in self.COLUMNS
+        }
+        # value -> code of the dictionary-encoded columns; codes are never reused
+        self.codes = {"persona": {}, "source": {}}
+        # tag -> {slot segment: set of slots}, for tags and emotional tags
+        self.tags = SegmentedDict()
+        self.emotional_tags = SegmentedDict()
+        # slot -> (tags, emotional tags), only read by the writer
+        self.slot_tags = SegmentedDict()
+        self.size = 0
+        self.shared = False
+        # (postings, tag) and (postings, tag, segment) copied since the last snapshot
+        self.owned_tags = set()
+        self.owned_segments = set()
+
+    def snapshot(self):
+        self.shared = True
+        snapshot = copy.copy(self)
+        snapshot.columns = {
+            name: column.snapshot() for name, column in self.columns.items()
+        }
+        snapshot.tags = self.tags.snapshot()
+        snapshot.emotional_tags = self.emotional_tags.snapshot()
+        snapshot.slot_tags = self.slot_tags.snapshot()
+        return snapshot
+
+    def restore(self, snapshot):
+        """Roll back to a snapshot taken earlier."""
+        vars(self).update(vars(snapshot.snapshot()))
+
+    def _unshare(self):
+        if self.shared:
+            self.owned_tags = set()
+            self.owned_segments = set()
+            self.shared = False
+
+    def _code(self, name, value):
+        value = str(value or "")
+        codes = self.codes[name]
+        if value not in codes:
+            # Snapshots share the codes, so a new one goes into a copy
+            self.codes = {**self.codes, name: {**codes, value: len(codes)}}
+        return self.codes[name][value]
+
+    def _posting(self, key, tag, slot):
+        """Segments of tag and its posting in the segment of slot, both writable."""
+        postings = getattr(self, key)
+        if (key, tag) not in self.owned_tags:
+            postings[tag] = dict(postings.get(tag, {}))
+            self.owned_tags.add((key, tag))
+        segments = postings[tag]
+        segment = slot // self.segment_size
+        if (key, tag, segment) not in self.owned_segments:
+            segments[segment] = set(segments.get(segment, ()))
+            self.owned_segments.add((key, tag, segment))
+        return segments, segments[segment]
+
+    def set(self, slot, memory, seq=None):
+        """Write the attributes of the memory now in slot.
+
+        seq numbers memories in insertion order and stays with a memory
+        when it moves to another slot; it is kept from the memory already
+        in slot unless given.
+        """
+        if seq is None:
+            seq = self.seq(slot)
+        self.remove(slot)
+        columns = self.columns
+        columns["seq"][slot] = seq
+        columns["persona"][slot] = self._code("persona", memory.get("ai_persona"))
+        columns["source"][slot] = self._code("source", memory.get("source"))
+        for name in ("timestamp", "last_accessed"):
+            columns[name][slot] = to_epoch(memory.get(name))
+        for name in ("importance", "confidence", "access_count"):
+            columns[name][slot] = to_float(memory.get(name))
+        tags = normalize_all(memory.get("tags"))
+        emotional_tags = normalize_all(memory.get("emotional_tags"))
+        for key, slot_tags in (("tags", tags), ("emotional_tags", emotional_tags)):
+            for tag in slot_tags:
+                self._posting(key, tag, slot)[1].add(slot)
+        self.slot_tags[slot] = (tags, emotional_tags)
+        self.size = max(self.size, slot + 1)
+
+    def remove(self, slot):
+        self._unshare()
+        if slot >= len(self.columns["persona"]):
+            return
+        for name, _, fill in self.COLUMNS:
+            self.columns[name][slot] = fill
+        tags, emotional_tags = self.slot_tags.pop(slot) or ((), ())
+        segment = slot // self.segment_size
+        for key, slot_tags in (("tags", tags), ("emotional_tags", emotional_tags)):
+            for tag in slot_tags:
+                segments, posting = self._posting(key, tag, slot)
+                posting.discard(slot)
+                if not posting:
+                    del segments[segment]
+                    self.owned_segments.discard((key, tag, segment))
+                if not segments:
+                    getattr(self, key).pop(tag)
+                    self.owned_tags.discard((key, tag))
+
+    def seq(self, slot):
+        """Insertion sequence number of the memory in slot, -1 if it is empty."""
+        return int(self.columns["seq"].get(slot))
+
+    def seqs(self):
+        """Insertion sequence numbers of every slot, -1 for empty ones."""
+        return self.columns["seq"].view()[: self.size]
+
+    def _in(self, name, values):
+        if isinstance(values, str):
+            values = [values]
+        codes = [
+            self.codes[name][value] for value in values if value in self.codes[name]
+        ]
+        return np.isin(self.columns[name].view()[: self.size], codes)
+
+    def tag_slots(self, tags, match="any"):
+        """Slots of the memories with any or all of the tags, in no order."""
+        slots = self._tag_slots(self.tags, tags, match)
+        return np.fromiter(slots, dtype=np.int64, count=len(slots))
+
+    def _tag_mask(self, postings, tags, match):
+        slots = self._tag_slots(postings, tags, match)
+        mask = np.zeros(self.size, dtype=bool)
+        mask[np.fromiter(slots, dtype=np.int64, count=len(slots))] = True
+        return mask
+
+    def _tag_slots(self, postings, tags, match):
+        tag_segments = [postings.get(tag, {}) for tag in normalize_all(tags)]
+        if match == "all":
+            # Only segments holding every tag can have a match
+            common = set.intersection(*map(set, tag_segments)) if tag_segments else ()
+            slots = set().union(
+                *[
+                    set.intersection(*[segments[segment] for segments in tag_segments])
+                    for segment in common
+                ]
+            )
+        elif match == "any":
+            slots = set().union(
+                *[posting for segments in tag_segments for posting in segments.values()]
+            )
+        else:
+            raise ValueError(f"Unknown tag match mode: {match}")
+        return slots
+
+    def mask(
+        self,
+        ai_persona=None,
+        source=None,
+        tags=None,
+        tag_match="any",
+        emotional_tags=None,
+        since=None,
+        until=None,
+        min_importance=None,
+    ):
+        """Boolean mask over slots of the memories matching every given filter.
+
+        ai_persona and source take one value or a list of accepted values.
+        tags match any or all of the tags depending on tag_match, emotional
+        tags match any of them. since and until bound the timestamp, given
+        as ISO strings or epoch seconds. Without filters every slot holding
+        a memory matches. Slots past the end of the mask do not match.
+        """
+        columns = {
+            name: column.view()[: self.size] for name, column in self.columns.items()
+        }
+        # Removed slots have no persona code
+        mask = columns["persona"] >= 0
+        if ai_persona is not None:
+            mask &= self._in("persona", ai_persona)
+        if source is not None:
+            mask &= self._in("source", source)
+        # Comparisons with NaN are False, so tombstones never match a range
+        if since is not None:
+            mask &= columns["timestamp"] >= to_epoch(since)
+        if until is not None:
+            mask &= columns["timestamp"] <= to_epoch(until)
+        if min_importance is not None:
+            mask &= columns["importance"] >= float(min_importance)
+        if tags:
+            mask &= self._tag_mask(self.tags, tags, tag_match)
+        if emotional_tags:
+            mask &= self._tag_mask(self.emotional_tags, emotional_tags, "any")
+        return mask
+
+    def score(
+        self, slots, similarities, weights, now=None, recency_half_life=30 * 86400
+    ):
+        """Weighted scores of candidate slots, computed in one pass over the columns.
+
+        The score is the sum over SCORE_WEIGHTS of weight times feature:
+        the similarity, importance, confidence, recency (1 for a memory
+        created now, halving every recency_half_life seconds) and the log of
+        one plus the access count. Similarity weighs 1 unless given and
+        missing values count as 0.
+        """
+        unknown = set(weights) - set(self.SCORE_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown score weights: {', '.join(sorted(unknown))}")
+        weights = {"similarity": 1.0, **weights}
+        now = datetime.now().timestamp() if now is None else now
+        columns = {name: column.view() for name, column in self.columns.items()}
+        age = np.maximum(now - columns["timestamp"][slots], 0)
+        features = {
+            "similarity": np.asarray(similarities, dtype=np.float64),
+            "importance": columns["importance"][slots],
+            "confidence": columns["confidence"][slots],
+            "recency": 0.5 ** (age / recency_half_life),
+            "access": np.log1p(columns["access_count"][slots]),
+        }
+        scores = np.zeros(len(slots), dtype=np.float64)
+        for name, weight in weights.items():
+            if weight:
+                scores += weight * np.nan_to_num(features[name])
+        return scores
@@ -0,0 +1,183 @@
+import copy
+import json
+import os
+
+import numpy as np
+
+from src.memory_utils.file_lock import try_lock
+
+
+class EmbeddingMatrix:
+    """Preallocated embedding buffer that grows by doubling its capacity.
+
+    Only the first ``count`` rows are valid. Appends write into spare
+    capacity, so adding a row costs O(d) amortized instead of copying the
+    whole matrix.
+
+    With a ``path`` the buffer is a memory-mapped flat float32 file instead
+    of heap memory, with a parallel file of fixed-width row labels. A matrix
+    that was closed cleanly is mapped as-is on the next start, so loading it
+    reads no vectors up front. After an unclean shutdown the files are discarded,
+    since their pages may have been flushed only partly.
+
+    Only the process holding an exclusive lock on ``<path>.lock`` maps the
+    files, and the OS drops the lock if it dies. Other processes keep their
+    rows in memory and leave the files, which are in use, alone.
+    """
+
+    LABEL_SIZE = 128
+
+    def __init__(self, embeddings=None, initial_capacity=1024, path=None):
+        self.initial_capacity = initial_capacity
+        self.path = path
+        self.buffer = None
+        self.labels = None
+        self.count = 0
+        # Set when the rows were mapped from a cleanly closed file
+        self.loaded = False
+        self.lock_file = None
+        if path:
+            self._open()
+        if embeddings is not None and len(embeddings) > 0:
+            self.append(embeddings)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def dim(self):
+        return None if self.buffer is None else self.buffer.shape[1]
+
+    @property
+    def capacity(self):
+        return 0 if self.buffer is None else len(self.buffer)
+
+    @property
+    def labels_path(self):
+        return self.path + ".labels"
+
+    @property
+    def meta_path(self):
+        return self.path + ".json"
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        if not meta["clean"] or meta["dim"] is None:
+            return None
+        return meta
+
+    def _open(self):
+        self.lock_file = try_lock(self.path + ".lock")
+        if self.lock_file is None:
+            # Another process writes the files, possibly this very moment
+            self.path = None
+            return
+        meta = self._read_meta()
+        if not meta:
+            for path in (self.path, self.labels_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._write_meta(clean=False)
+            return
+        self._map(os.path.getsize(self.path) // (meta["dim"] * 4), meta["dim"])
+        self.count = meta["count"]
+        self.loaded = True
+        # Mutations from here on are not on disk until close()
+        self._write_meta(clean=False)
+
+    def _map(self, capacity, dim):
+        for path, size in ((self.path, dim * 4), (self.labels_path, self.LABEL_SIZE)):
+            with open(path, "ab") as f:
+                if f.tell() < capacity * size:
+                    f.truncate(capacity * size)
+        # Extending the files leaves earlier mappings, e.g. in snapshots, valid
+        self.buffer = np.memmap(
+            self.path, dtype=np.float32, mode="r+", shape=(capacity, dim)
+        )
+        self.labels = np.memmap(
+            self.labels_path, dtype=f"S{self.LABEL_SIZE}", mode="r+", shape=(capacity,)
+        )
+
+    def _write_meta(self, clean):
+        tmp_path = self.meta_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "count": self.count, "clean": clean}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def close(self):
+        """Flush a file-backed matrix and mark it safe to map on the next start."""
+        if self.path:
+            if self.buffer is not None:
+                self.buffer.flush()
+                self.labels.flush()
+            self._write_meta(clean=True)
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def _reserve(self, count, dim):
+        if self.buffer is None:
+            capacity = max(self.initial_capacity, count)
+        elif count <= self.capacity:
+            return
+        else:
+            capacity = self.capacity
+            while capacity < count:
+                capacity *= 2
+        if self.path:
+            self._map(capacity, dim)
+            return
+        buffer = np.zeros((capacity, dim), dtype=np.float32)
+        if self.buffer is not None:
+            buffer[: self.count] = self.buffer[: self.count]
+        self.buffer = buffer
+
+    def append(self, vectors, labels=None):
+        """Append one or more rows and return the index of the first one."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        start = self.count
+        self._reserve(start + len(vectors), vectors.shape[1])
+        self.buffer[start : start + len(vectors)] = vectors
+        if self.labels is not None and labels is not None:
+            self.labels[start : start + len(vectors)] = [
+                label.encode("utf-8") for label in labels
+            ]
+        self.count += len(vectors)
+        return start
+
+    def put(self, row, vector, label=""):
+        """Write a row, growing the valid rows up to it if needed."""
+        vector = np.asarray(vector, dtype=np.float32)
+        self._reserve(max(self.count, row + 1), vector.shape[-1])
+        self.buffer[row] = vector
+        if self.labels is not None:
+            self.labels[row] = label.encode("utf-8")
+        # Rows between the old count and row are still zero from allocation
+        self.count = max(self.count, row + 1)
+
+    def label(self, row):
+        """Label stored with a row of a file-backed matrix."""
+        return self.labels[row].decode("utf-8")
+
+    def __getitem__(self, row):
+        return self.view()[row]
+
+    def __setitem__(self, row, vector):
+        if not 0 <= row < self.count:
+            raise IndexError(f"Row {row} out of range for {self.count} rows")
+        self.buffer[row] = vector
+
+    def snapshot(self):
+        """Matrix over the current rows that later appends and growth leave alone."""
+        return copy.copy(self)
+
+    def view(self):
+        """Read-only view of the valid rows, without copying."""
+        if self.buffer is None:
+            return np.empty((0, 0), dtype=np.float32)
+        view = self.buffer[: self.count]
+        view.flags.writeable = False
+        return view
@@ -0,0 +1,96 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingWorker:
+    """Background thread that embeds queued items in micro-batches.
+
+    Items that arrive within max_wait seconds of the first one, up to
+    max_batch_size, are handed to process_batch together so the model runs
+    one batched forward pass instead of one per item.
+
+    If process_batch raises, its items are queued again up to max_retries
+    times; items that still fail are handed to on_failure.
+    """
+
+    def __init__(
+        self,
+        process_batch,
+        max_batch_size=64,
+        max_wait=0.01,
+        max_retries=0,
+        on_failure=None,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.on_failure = on_failure
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, items):
+        # Queued with the number of failed attempts so far
+        for item in items:
+            self.queue.put((item, 0))
+
+    def join(self):
+        """Block until every submitted item has been processed."""
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish this batch first, then stop on the next call
+                self.queue.task_done()
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self.queue.task_done()
+                return
+            try:
+                self.process_batch([item for item, _ in batch])
+            except Exception:
+                logger.exception(f"Error embedding a batch of {len(batch)} items")
+                self._retry(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _retry(self, batch):
+        # Queued again before task_done, so join() also waits for the retries
+        failed = []
+        for item, attempts in batch:
+            if attempts < self.max_retries:
+                self.queue.put((item, attempts + 1))
+            else:
+                failed.append(item)
+        if failed and self.on_failure:
+            try:
+                self.on_failure(failed)
+            except Exception:
+                logger.exception(f"Error reporting {len(failed)} failed items")
@@ -0,0 +1,32 @@
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+def try_lock(path):
+    """Open path and take an exclusive lock on it, or return None if another process holds it.
+
+    The lock lasts until the returned file is closed, and the OS drops it
+    if the process dies.
+    """
+    lock = open(path, "a+")
+    try:
+        if fcntl:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(lock.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def lock_file(path):
+    """Like try_lock, but raise if another process holds the lock."""
+    lock = try_lock(path)
+    if lock is None:
+        raise RuntimeError(f"{path} is locked by another process")
+    return lock
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import yaml
+
+from src.memory_utils.file_lock import lock_file
+
+logger = logging.getLogger(__name__)
+
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class MemoryLogStore:
+    """Snapshot plus append-only write-ahead log persistence for memories.
+
+    Mutations are appended to ``<file_path>.log`` as JSON lines and fsynced in
+    groups by a background thread, so concurrent writers share a single
+    fsync. ``rotate_log`` and ``write_snapshot`` fold the log into a new YAML
+    snapshot at ``file_path``.
+
+    Only one store may have the files open at a time: another process
+    rotating the log would leave this one appending to a deleted file.
+    ``load`` takes an exclusive lock on ``<file_path>.lock`` until ``close``.
+    """
+
+    def __init__(self, file_path="memories.yaml", group_commit_delay=0.002):
+        self.file_path = file_path
+        self.log_path = file_path + ".log"
+        self.rotated_log_path = file_path + ".log.old"
+        self.group_commit_delay = group_commit_delay
+        self.snapshot_records = 0
+        self.log_records = 0
+
+        self.cond = threading.Condition()
+        self.sync_lock = threading.Lock()
+        self.written_seq = 0
+        self.synced_seq = 0
+        self.closed = False
+        self.log_file = None
+        self.lock_file = None
+
+    def load(self):
+        """Load the snapshot and replay any logged mutations on top of it."""
+        self.lock_file = lock_file(self.file_path + ".lock")
+        memories = {}
+        if os.path.exists(self.file_path):
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                for memory in yaml.load(f, Loader=YamlLoader) or []:
+                    memories[memory["id"]] = memory
+        self.snapshot_records = len(memories)
+
+        replayed = self._replay(self.rotated_log_path, memories)
+        replayed += self._replay(self.log_path, memories)
+        if replayed:
+            logger.info(f"Replayed {replayed} logged mutations")
+        self.log_records = replayed
+
+        self.log_file = open(self.log_path, "a", encoding="utf-8")
+        threading.Thread(target=self._sync_loop, daemon=True).start()
+        return list(memories.values())
+
+    def _replay(self, path, memories):
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        valid_size = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Ignoring torn record at end of {path}")
+                    break
+                self._apply(record, memories)
+                valid_size += len(line)
+                count += 1
+        # Cut off a partially written record so later appends start cleanly
+        if valid_size < os.path.getsize(path):
+            os.truncate(path, valid_size)
+        return count
+
+    def _apply(self, record, memories):
+        if record["op"] == "put":
+            memories[record["memory"]["id"]] = record["memory"]
+        elif record["op"] == "delete":
+            memories.pop(record["id"], None)
+
+    def _append(self, records):
+        data = "".join(
+            json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            for record in records
+        )
+        with self.cond:
+            self.log_file.write(data)
+            self.log_records += len(records)
+            self.written_seq += 1
+            self.cond.notify_all()
+            return self.written_seq
+
+    def put(self, memory):
+        """Log an added or updated memory. Returns a sequence number for sync()."""
+        return self._append([{"op": "put", "memory": memory}])
+
+    def put_many(self, memories):
+        return self._append([{"op": "put", "memory": memory} for memory in memories])
+
+    def delete(self, memory_id):
+        return self._append([{"op": "delete", "id": memory_id}])
+
+    def sync(self, seq):
+        """Block until the record with the given sequence number is on disk."""
+        with self.cond:
+            while self.synced_seq < seq:
+                self.cond.wait()
+
+    def _sync_loop(self):
+        while True:
+            with self.cond:
+                while self.synced_seq == self.written_seq and not self.closed:
+                    self.cond.wait()
+                if self.closed and self.synced_seq == self.written_seq:
+                    return
+            # Give concurrent writers a moment to join this fsync
+            time.sleep(self.group_commit_delay)
+            with self.sync_lock:
+                with self.cond:
+                    if self.closed:
+                        return
+                    target = self.written_seq
+                    self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+            with self.cond:
+                self.synced_seq = max(self.synced_seq, target)
+                self.cond.notify_all()
+
+    def needs_compaction(self, min_records=1000):
+        # Compacting once the log outgrows the snapshot keeps the amortized
+        # cost of each write constant
+        return self.log_records >= max(min_records, self.snapshot_records)
+
+    def rotate_log(self):
+        """Move the current log aside so that new records go to a fresh file.
+
+        Must be called while no mutations are in flight; the caller then
+        passes the matching state to ``write_snapshot``.
+        """
+        with self.sync_lock:
+            with self.cond:
+                self.log_file.flush()
+                os.fsync(self.log_file.fileno())
+                self.log_file.close()
+                if os.path.exists(self.rotated_log_path):
+                    # A previous compaction did not finish; keep its records
+                    with open(self.log_path, "rb") as src, open(
+                        self.rotated_log_path, "ab"
+                    ) as dst:
+                        dst.write(src.read())
+                    os.remove(self.log_path)
+                else:
+                    os.replace(self.log_path, self.rotated_log_path)
+                self.log_file = open(self.log_path, "a", encoding="utf-8")
+                self.log_records = 0
+                self.synced_seq = self.written_seq
+                self.cond.notify_all()
+
+    def write_snapshot(self, memories):
+        """Atomically replace the snapshot and drop the rotated log it covers."""
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            yaml.dump(
+                memories,
+                f,
+                Dumper=YamlDumper,
+                sort_keys=False,
+                default_flow_style=False,
+                allow_unicode=True,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        if os.path.exists(self.rotated_log_path):
+            os.remove(self.rotated_log_path)
+        self.snapshot_records = len(memories)
+
+    def close(self):
+        with self.sync_lock:
+            with self.cond:
+                self.closed = True
+                if self.log_file:
+                    self.log_file.flush()
+                    os.fsync(self.log_file.fileno())
+                    self.log_file.close()
+                    self.log_file = None
+                if self.lock_file:
+                    self.lock_file.close()
+                    self.lock_file = None
+                self.synced_seq = self.written_seq
+                self.cond.notify_all()
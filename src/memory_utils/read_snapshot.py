@@ -0,0 +1,55 @@
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+import threading
+
+# Immutable state searched by readers. slots and id_to_slot are never
+# mutated once published and the indexes and columns are frozen copies.
+ReadSnapshot = namedtuple(
+    "ReadSnapshot",
+    ["version", "slots", "id_to_slot", "vector_index", "text_index", "columns"],
+)
+
+
+class SnapshotPublisher:
+    """Hands out the latest ReadSnapshot and tracks the versions still in use.
+
+    The single writer publishes a new snapshot after each mutation. Readers
+    only take a short lock to register, so they never wait for a write, and
+    the writer can ask for the oldest version a reader may still be using
+    before reusing rows that version refers to.
+    """
+
+    def __init__(self, snapshot):
+        self.current = snapshot
+        self.readers = Counter()
+        self.lock = threading.Lock()
+
+    def publish(self, slots, id_to_slot, vector_index, text_index, columns):
+        snapshot = ReadSnapshot(
+            self.current.version + 1,
+            slots,
+            id_to_slot,
+            vector_index,
+            text_index,
+            columns,
+        )
+        with self.lock:
+            self.current = snapshot
+        return snapshot
+
+    @contextmanager
+    def read(self):
+        with self.lock:
+            snapshot = self.current
+            self.readers[snapshot.version] += 1
+        try:
+            yield snapshot
+        finally:
+            with self.lock:
+                self.readers[snapshot.version] -= 1
+                if not self.readers[snapshot.version]:
+                    del self.readers[snapshot.version]
+
+    def oldest_version(self):
+        with self.lock:
+            return min(self.readers, default=self.current.version)
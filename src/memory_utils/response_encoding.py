@@ -0,0 +1,86 @@
+import json
+
+try:
+    import orjson
+
+    ORJSON_IMPORT_SUCCESS = True
+except ImportError:
+    ORJSON_IMPORT_SUCCESS = False
+
+try:
+    import msgpack
+
+    MSGPACK_IMPORT_SUCCESS = True
+except ImportError:
+    MSGPACK_IMPORT_SUCCESS = False
+
+JSON_MIMETYPE = "application/json"
+MSGPACK_MIMETYPE = "application/msgpack"
+# One JSON document per line, for streamed listings
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def parse_fields(fields):
+    """Field paths from a list of names and comma-separated name lists, or None for all."""
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = [fields]
+    return [
+        field.strip() for value in fields for field in value.split(",") if field.strip()
+    ] or None
+
+
+def project(memory, fields):
+    """Copy of memory with only the given fields; "context.explanation" selects a nested one."""
+    if fields is None or memory is None:
+        return memory
+    projected = {}
+    for field in fields:
+        key, _, nested = field.partition(".")
+        if key not in memory:
+            continue
+        value = memory[key]
+        if not nested:
+            projected[key] = value
+        elif isinstance(value, dict) and nested in value:
+            projected.setdefault(key, {})[nested] = value[nested]
+    return projected
+
+
+def project_all(memories, fields):
+    if fields is None:
+        return memories
+    return [project(memory, fields) for memory in memories]
+
+
+def supported_mimetypes():
+    """Response encodings available here, preferred first."""
+    if MSGPACK_IMPORT_SUCCESS:
+        return [JSON_MIMETYPE, MSGPACK_MIMETYPE]
+    return [JSON_MIMETYPE]
+
+
+def encode(data, mimetype=JSON_MIMETYPE):
+    """Serialize a response body as msgpack or compact JSON.
+
+    JSON is written by orjson when it is installed, which is several times
+    faster than the standard library, and without whitespace either way.
+    """
+    if mimetype == MSGPACK_MIMETYPE:
+        if not MSGPACK_IMPORT_SUCCESS:
+            raise ImportError("msgpack is required for msgpack responses")
+        return msgpack.packb(data, use_bin_type=True)
+    if ORJSON_IMPORT_SUCCESS:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def decode(body, mimetype=JSON_MIMETYPE):
+    if mimetype == MSGPACK_MIMETYPE:
+        if not MSGPACK_IMPORT_SUCCESS:
+            raise ImportError("msgpack is required for msgpack responses")
+        return msgpack.unpackb(body, raw=False)
+    if ORJSON_IMPORT_SUCCESS:
+        return orjson.loads(body)
+    return json.loads(body)
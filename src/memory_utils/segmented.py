@@ -0,0 +1,201 @@
+import copy
+from itertools import chain
+
+import numpy as np
+
+# Entries per segment; a write copies at most one segment of a structure
+# that is shared with a snapshot
+SEGMENT_SIZE = 1024
+
+
+class Segmented:
+    """Copy-on-write base of the segmented containers.
+
+    snapshot() returns a frozen copy sharing every segment with this
+    container. The next write copies the list of segments and then only the
+    segments it changes, once each until the next snapshot, so a write costs
+    O(segment size + number of segments) instead of O(size).
+    """
+
+    def __init__(self, segment_size=SEGMENT_SIZE):
+        self.segment_size = segment_size
+        self.segments = []
+        # Segments copied since the last snapshot, which may be changed in place
+        self.owned = set()
+        self.shared = False
+
+    def snapshot(self):
+        # The copy is marked shared too, so that it can become a writer again
+        self.shared = True
+        return copy.copy(self)
+
+    def _unshare(self):
+        if self.shared:
+            self.segments = list(self.segments)
+            self.owned = set()
+            self.shared = False
+
+    def _copy_segment(self, segment):
+        return segment.copy()
+
+    def _own(self, index):
+        """Segment index, copied first unless this container already owns it."""
+        self._unshare()
+        if index not in self.owned:
+            self.segments[index] = self._copy_segment(self.segments[index])
+            self.owned.add(index)
+        return self.segments[index]
+
+
+class SegmentedList(Segmented):
+    """List split into fixed-size segments, see Segmented."""
+
+    def __init__(self, values=(), segment_size=SEGMENT_SIZE):
+        super().__init__(segment_size)
+        self.length = 0
+        for value in values:
+            self.append(value)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.segments)
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError(f"Index {index} out of range for {self.length} items")
+        return self.segments[index // self.segment_size][index % self.segment_size]
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < self.length:
+            raise IndexError(f"Index {index} out of range for {self.length} items")
+        self._own(index // self.segment_size)[index % self.segment_size] = value
+
+    def append(self, value):
+        self._unshare()
+        if self.length % self.segment_size == 0:
+            self.segments.append([])
+            self.owned.add(len(self.segments) - 1)
+        self._own(len(self.segments) - 1).append(value)
+        self.length += 1
+
+
+class SegmentedDict(Segmented):
+    """Dict sharded by key hash into segments, see Segmented.
+
+    The number of shards doubles when they hold segment_size keys on
+    average, which rehashes every key once per doubling.
+    """
+
+    def __init__(self, items=(), segment_size=SEGMENT_SIZE):
+        super().__init__(segment_size)
+        self.segments = [{}]
+        self.owned = {0}
+        self.length = 0
+        for key, value in dict(items).items():
+            self[key] = value
+
+    def _shard(self, key):
+        # The number of shards is a power of two
+        return hash(key) & (len(self.segments) - 1)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return chain.from_iterable(self.segments)
+
+    def __contains__(self, key):
+        return key in self.segments[self._shard(key)]
+
+    def __getitem__(self, key):
+        return self.segments[self._shard(key)][key]
+
+    def get(self, key, default=None):
+        return self.segments[self._shard(key)].get(key, default)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return chain.from_iterable(shard.values() for shard in self.segments)
+
+    def items(self):
+        return chain.from_iterable(shard.items() for shard in self.segments)
+
+    def __setitem__(self, key, value):
+        shard = self._own(self._shard(key))
+        if key not in shard:
+            self.length += 1
+        shard[key] = value
+        if self.length > len(self.segments) * self.segment_size:
+            self._grow()
+
+    def pop(self, key, default=None):
+        if key not in self:
+            return default
+        self.length -= 1
+        return self._own(self._shard(key)).pop(key)
+
+    def _grow(self):
+        shards = [{} for _ in range(2 * len(self.segments))]
+        for key, value in self.items():
+            shards[hash(key) & (len(shards) - 1)][key] = value
+        self.segments = shards
+        self.owned = set(range(len(shards)))
+
+
+class SegmentedArray(Segmented):
+    """NumPy array split into fixed-size segments, see Segmented.
+
+    Writes past the end grow the array with fill values. Readers take
+    view(), one contiguous array that is built on first use and cached until
+    the next write, so a snapshot is concatenated at most once.
+    """
+
+    def __init__(self, dtype, fill, values=None, segment_size=SEGMENT_SIZE):
+        super().__init__(segment_size)
+        self.dtype = dtype
+        self.fill = fill
+        self.cache = None
+        if values is not None:
+            values = np.asarray(values, dtype=dtype)
+            self._reserve(len(values) - 1)
+            for index, start in enumerate(range(0, len(values), segment_size)):
+                chunk = values[start : start + segment_size]
+                self.segments[index][: len(chunk)] = chunk
+
+    def __len__(self):
+        return len(self.segments) * self.segment_size
+
+    def _reserve(self, index):
+        self._unshare()
+        while len(self) <= index:
+            self.segments.append(
+                np.full(self.segment_size, self.fill, dtype=self.dtype)
+            )
+            self.owned.add(len(self.segments) - 1)
+
+    def get(self, index):
+        """Value at index, or the fill value past the end."""
+        if index >= len(self):
+            return self.fill
+        return self.segments[index // self.segment_size][index % self.segment_size]
+
+    def __setitem__(self, index, value):
+        self._reserve(index)
+        self._own(index // self.segment_size)[index % self.segment_size] = value
+        self.cache = None
+
+    def view(self):
+        """Read-only contiguous array of every segment."""
+        cache = self.cache
+        if cache is None:
+            if self.segments:
+                cache = np.concatenate(self.segments)
+            else:
+                cache = np.empty(0, dtype=self.dtype)
+            cache.flags.writeable = False
+            self.cache = cache
+        return cache
@@ -1,40 +1,393 @@
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
 from datetime import datetime
 import logging
-import yaml
 import os
+import re
+import threading
 import uuid
 import numpy as np
-from src.memory_embeddings.stella_embeddings import StellaEmbeddings
+from src.memory_embeddings.base_embeddings import normalize
+from src.memory_embeddings.embedder_factory import create_embedder
+from src.memory_embeddings.embedding_cache import EmbeddingCache
+from src.memory_embeddings.query_cache import QueryEmbeddingCache
+from src.memory_utils.attribute_columns import AttributeColumns
+from src.memory_utils.embedding_matrix import EmbeddingMatrix
+from src.memory_utils.embedding_worker import EmbeddingWorker
+from src.memory_utils.memory_log_store import MemoryLogStore
+from src.memory_utils.read_snapshot import ReadSnapshot, SnapshotPublisher
+from src.memory_utils.segmented import SegmentedDict, SegmentedList
+from src.memory_utils.sqlite_memory_store import SqliteEmbeddingCache, SqliteMemoryStore
+from src.memory_utils.text_index import TextIndex, reciprocal_rank_fusion
+from src.memory_utils.vector_index import create_vector_index, measure_recall, top_k
 
 logger = logging.getLogger(__name__)
 
 
 class ServerMemoryManager:
-    def __init__(self, file_path="memories.yaml"):
+    SEARCH_MODES = ("vector", "hybrid", "lexical")
+    # Candidates taken from each ranking before hybrid fusion
+    HYBRID_DEPTH = 50
+    # Candidates re-ranked by weighted score, see AttributeColumns.score
+    RERANK_DEPTH = 50
+
+    def __init__(
+        self,
+        file_path="memories.yaml",
+        cache_dir="embedding_cache",
+        compaction_interval=10.0,
+        vector_index="ivf",
+        vector_index_params=None,
+        query_cache_size=4096,
+        query_cache_ttl=None,
+        embedder=None,
+        async_embedding=False,
+        coalesce_searches=False,
+        search_batch_size=32,
+        search_max_wait=0.003,
+        embedding_retries=2,
+        storage=None,
+        mmap_embeddings=False,
+        score_weights=None,
+        recency_half_life=30 * 86400,
+        track_access=False,
+    ):
         self.file_path = file_path
-        self.memories = self.load()
-        self.embedder = StellaEmbeddings()
-        self.embeddings = self.embed_all_documents()
-        logger.info(f"Loaded {len(self.memories)} memories from {self.file_path}")
+        # Every entry point opening the store must agree on its format, so
+        # the default comes from the environment, as the server's does
+        storage = storage or os.getenv("MEMORY_STORAGE", "yaml")
+        if storage == "sqlite":
+            # memories.yaml becomes memories.db and is migrated on first start
+            self.db_path = os.path.splitext(file_path)[0] + ".db"
+            self.store = SqliteMemoryStore(self.db_path, migrate_from=file_path)
+        elif storage == "yaml":
+            self.db_path = None
+            self.store = MemoryLogStore(file_path)
+        else:
+            raise ValueError(f"Unknown memory storage: {storage}")
+        # Serializes mutations and their log records; save() also holds it
+        # while rotating the log so the snapshot matches the log position
+        self.write_lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        memories = self.load()
+        self.embedder = embedder or create_embedder()
+        if self.db_path:
+            self.embedding_cache = SqliteEmbeddingCache(
+                self.embedder.model_id, self.db_path
+            )
+        else:
+            self.embedding_cache = EmbeddingCache(self.embedder.model_id, cache_dir)
+        self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_ttl)
+
+        # Row i of self.embeddings belongs to self.slots[i]; deleted memories
+        # leave a None tombstone. Their slot is retired and only reused once
+        # no reader snapshot can still refer to the old row
+        embeddings_path = None
+        if mmap_embeddings:
+            # One file per model, since rows are only reusable with their model
+            model_slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", self.embedder.model_id)
+            embeddings_path = f"{os.path.splitext(file_path)[0]}.{model_slug}.f32"
+        self.embeddings = EmbeddingMatrix(path=embeddings_path)
+        self.slots = SegmentedList(self.load_embeddings(memories))
+        self.id_to_slot = SegmentedDict(
+            (memory["id"], i)
+            for i, memory in enumerate(self.slots)
+            if memory is not None
+        )
+        self.free_slots = [i for i, memory in enumerate(self.slots) if memory is None]
+        self.retired_slots = deque()
+        # Free slots allocated by the running mutation, returned if it fails
+        self.taken_slots = []
+        self.text_index = TextIndex()
+        self.columns = AttributeColumns()
+        # Memories are numbered in store order, and new ones after them
+        seqs = {memory["id"]: seq for seq, memory in enumerate(memories)}
+        self.next_seq = len(memories)
+        for memory_id, slot in self.id_to_slot.items():
+            self.text_index.add(slot, self.get_lexical_text(self.slots[slot]))
+            self.columns.set(slot, self.slots[slot], seqs[memory_id])
+        self.vector_index = create_vector_index(
+            vector_index, self.embeddings, **(vector_index_params or {})
+        )
+        for slot in self.id_to_slot.values():
+            self.vector_index.add(slot)
+        # Searches read the latest published snapshot and never take
+        # write_lock; mutations publish a new one when they finish
+        self.snapshots = SnapshotPublisher(
+            ReadSnapshot(
+                0,
+                self.slots.snapshot(),
+                self.id_to_slot.snapshot(),
+                self.vector_index.snapshot(),
+                self.text_index.snapshot(),
+                self.columns.snapshot(),
+            )
+        )
+        logger.info(f"Loaded {len(self.memories)} memories from {self.store.file_path}")
+
+        # With async_embedding, adds return once the memory is logged and a
+        # worker embeds it; it is searchable once its id leaves pending_ids.
+        # Batches that fail are retried embedding_retries times, after which
+        # the ids are also in failed_ids, which is replaced rather than
+        # modified so memory_status can read it without write_lock
+        self.pending_ids = set()
+        self.failed_ids = frozenset()
+        self.embedding_worker = (
+            EmbeddingWorker(
+                self.attach_pending_embeddings,
+                max_retries=embedding_retries,
+                on_failure=self.fail_pending_embeddings,
+            )
+            if async_embedding
+            else None
+        )
+        # With coalesce_searches, concurrent search() calls are gathered for up
+        # to search_max_wait seconds and encoded and scored as one batch
+        self.search_worker = (
+            EmbeddingWorker(
+                self.run_search_batch,
+                max_batch_size=search_batch_size,
+                max_wait=search_max_wait,
+            )
+            if coalesce_searches
+            else None
+        )
+
+        # Default weights of search re-ranking, e.g. {"importance": 0.1}
+        self.score_weights = score_weights or {}
+        self.recency_half_life = recency_half_life
+        # With track_access, search hits are counted here, off the write
+        # path, and the maintenance loop folds them into the memories in
+        # one batch: memory id -> (hits, time of the last hit)
+        self.track_access = track_access
+        self.access_lock = threading.Lock()
+        self.pending_access = {}
+
+        self.compaction_interval = compaction_interval
+        self.stop_event = threading.Event()
+        self.maintenance_thread = threading.Thread(
+            target=self._maintenance_loop, daemon=True
+        )
+        self.maintenance_thread.start()
+
+    @property
+    def memories(self):
+        """Live memories as of the latest published snapshot, in store order."""
+        snapshot = self.snapshots.current
+        slots = np.flatnonzero(snapshot.columns.seqs() >= 0)
+        return self.in_store_order(snapshot, slots)
 
     def load(self):
-        if os.path.exists(self.file_path):
-            with open(self.file_path, "r") as f:
-                return yaml.safe_load(f) or []
-        return []
+        return self.store.load()
 
     def save(self):
-        with open(self.file_path, "w") as f:
-            yaml.dump(
-                self.memories,
-                f,
-                sort_keys=False,
-                default_flow_style=False,
-                allow_unicode=True,
+        """Write a full snapshot of the memories and drop the log it covers."""
+        with self.save_lock:
+            with self.write_lock:
+                memories = list(self.memories)
+                self.store.rotate_log()
+            # Mutations that land after the rotation are replayed from the new
+            # log, so the snapshot itself can be written without blocking them
+            self.store.write_snapshot([dict(memory) for memory in memories])
+
+    @contextmanager
+    def mutation(self):
+        """Hold write_lock for a change and publish a new read snapshot after it.
+
+        Published structures are copy-on-write, so the writer only copies the
+        segments it changes, and memories are replaced rather than modified.
+        If the change raises, the writer is rolled back to the last published
+        snapshot.
+        """
+        with self.write_lock:
+            self.reclaim_slots()
+            published = self.snapshots.current
+            retired_count = len(self.retired_slots)
+            pending_ids = set(self.pending_ids)
+            failed_ids = self.failed_ids
+            self.taken_slots = []
+            try:
+                yield
+            except BaseException:
+                self.rollback(published, retired_count, pending_ids, failed_ids)
+                raise
+            self.snapshots.publish(
+                self.slots.snapshot(),
+                self.id_to_slot.snapshot(),
+                self.vector_index.snapshot(),
+                self.text_index.snapshot(),
+                self.columns.snapshot(),
             )
 
+    def rollback(self, snapshot, retired_count, pending_ids, failed_ids):
+        """Undo a failed mutation, returning the writer to snapshot."""
+        self.slots = snapshot.slots.snapshot()
+        self.id_to_slot = snapshot.id_to_slot.snapshot()
+        self.vector_index.restore(snapshot.vector_index)
+        self.text_index.restore(snapshot.text_index)
+        self.columns.restore(snapshot.columns)
+        # Slots allocated by the change are free again and those it retired
+        # are live again
+        self.free_slots.extend(reversed(self.taken_slots))
+        while len(self.retired_slots) > retired_count:
+            self.retired_slots.pop()
+        self.pending_ids = pending_ids
+        self.failed_ids = failed_ids
+
+    def _maintenance_loop(self):
+        # The index of the loaded store is trained here as well, so that
+        # startup does not wait for it; it is searched exactly until then
+        try:
+            self.train_vector_index()
+        except Exception:
+            logger.exception("Error training the vector index")
+        while not self.stop_event.wait(self.compaction_interval):
+            try:
+                self.flush_access_stats()
+                if self.store.needs_compaction():
+                    self.save()
+                self.train_vector_index()
+            except Exception:
+                logger.exception("Error in memory maintenance")
+
+    def train_vector_index(self):
+        """Retrain the vector index if it needs it, holding write_lock only to swap it in."""
+        with self.snapshots.read() as snapshot:
+            if not snapshot.vector_index.needs_training():
+                return
+            # While the snapshot is read its retired slots are not reused, so
+            # the rows trained on are unchanged when the result is installed
+            trained = snapshot.vector_index.fit()
+            with self.mutation():
+                self.vector_index.install(trained)
+
+    def close(self):
+        if self.embedding_worker:
+            self.embedding_worker.close()
+        if self.search_worker:
+            self.search_worker.close()
+        self.stop_event.set()
+        self.maintenance_thread.join()
+        self.flush_access_stats()
+        with self.write_lock:
+            self.embeddings.close()
+        self.store.close()
+
     def add(self, data):
-        memory = {
+        return self.add_many([data])[0]
+
+    def add_many(self, data_list):
+        """Add several memories with one batched embedding pass and one log write."""
+        memories = [self.create_memory(data) for data in data_list]
+        texts = [self.get_embedding_text(memory) for memory in memories]
+        if self.embedding_worker:
+            new_embeddings = [None] * len(memories)
+        else:
+            new_embeddings = self.embed_texts(texts)
+
+        with self.mutation():
+            for memory, new_embedding in zip(memories, new_embeddings):
+                self.insert_memory(memory, new_embedding)
+            seq = self.store.put_many(memories)
+        self.store.sync(seq)
+
+        if self.embedding_worker:
+            self.embedding_worker.submit(
+                [(memory["id"], text) for memory, text in zip(memories, texts)]
+            )
+        return [memory["id"] for memory in memories]
+
+    def attach_pending_embeddings(self, items):
+        """Embed (memory_id, text) items queued by add_many and make them searchable."""
+        new_embeddings = self.embed_texts([text for _, text in items])
+        with self.mutation():
+            for (memory_id, text), new_embedding in zip(items, new_embeddings):
+                slot = self.id_to_slot.get(memory_id)
+                # Skip memories deleted or re-embedded by an update meanwhile
+                if (
+                    memory_id not in self.pending_ids
+                    or self.get_embedding_text(self.slots[slot]) != text
+                ):
+                    continue
+                self.embeddings.put(
+                    slot, new_embedding, self.row_label(self.slots[slot])
+                )
+                self.vector_index.add(slot)
+                self.pending_ids.discard(memory_id)
+
+    def fail_pending_embeddings(self, items):
+        """Report (memory_id, text) items that could not be embedded as failed.
+
+        They stay lexically searchable, and an update that changes their
+        text embeds them again.
+        """
+        with self.write_lock:
+            failed = {
+                memory_id for memory_id, _ in items if memory_id in self.pending_ids
+            }
+            self.failed_ids = self.failed_ids | failed
+        logger.error(f"Gave up embedding {len(failed)} memories")
+
+    def record_access(self, memories):
+        """Count search hits; cheap enough for the read path, see flush_access_stats."""
+        if not self.track_access or not memories:
+            return
+        now = datetime.now().isoformat()
+        with self.access_lock:
+            for memory in memories:
+                hits, _ = self.pending_access.get(memory["id"], (0, None))
+                self.pending_access[memory["id"]] = (hits + 1, now)
+
+    def flush_access_stats(self):
+        """Add the recorded hits to access_count and last_accessed and log them.
+
+        All memories hit since the last flush are written in one batch.
+        Returns the number of memories updated.
+        """
+        with self.access_lock:
+            pending, self.pending_access = self.pending_access, {}
+        if not pending:
+            return 0
+        with self.mutation():
+            memories = []
+            for memory_id, (hits, last_accessed) in pending.items():
+                slot = self.id_to_slot.get(memory_id)
+                if slot is None:
+                    continue
+                memory = {
+                    **self.slots[slot],
+                    "access_count": (self.slots[slot].get("access_count") or 0) + hits,
+                    "last_accessed": last_accessed,
+                }
+                self.slots[slot] = memory
+                self.columns.set(slot, memory)
+                memories.append(memory)
+            # Access stats are not worth waiting for an fsync, so this does
+            # not sync() and the store flushes them in the background
+            if memories:
+                self.store.put_many(memories)
+        return len(memories)
+
+    def wait_for_embeddings(self):
+        if self.embedding_worker:
+            self.embedding_worker.join()
+
+    def memory_status(self, memory_id):
+        """Return "pending" until the memory is searchable, "ready" after, None if unknown.
+
+        Memories whose embedding kept failing are "failed".
+        """
+        snapshot = self.snapshots.current
+        slot = snapshot.id_to_slot.get(memory_id)
+        if slot is None:
+            return None
+        if slot in snapshot.vector_index:
+            return "ready"
+        return "failed" if memory_id in self.failed_ids else "pending"
+
+    def create_memory(self, data):
+        return {
             "id": str(uuid.uuid4()),
             "ai_persona": data.get("ai_persona", ""),
             "topic": data.get("topic", ""),
@@ -60,11 +413,49 @@ class ServerMemoryManager:
             },
             "emotional_tags": data.get("emotional_tags", []),
         }
-        self.memories.append(memory)
-        self.add_embedding(memory)
 
-        self.save()
-        return memory["id"]
+    def insert_memory(self, memory, new_embedding):
+        """Place a memory and its embedding in a slot. Caller is in mutation().
+
+        Without an embedding the memory is stored but left out of the vector
+        index until attach_pending_embeddings provides one.
+        """
+        slot = self.allocate_slot(memory)
+        self.id_to_slot[memory["id"]] = slot
+        # Lexical search finds the memory even while its embedding is pending
+        self.text_index.add(slot, self.get_lexical_text(memory))
+        self.columns.set(slot, memory, self.next_seq)
+        self.next_seq += 1
+        if new_embedding is None:
+            self.pending_ids.add(memory["id"])
+        else:
+            self.embeddings.put(slot, new_embedding, self.row_label(memory))
+            self.vector_index.add(slot)
+
+    def allocate_slot(self, memory):
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.taken_slots.append(slot)
+            self.slots[slot] = memory
+        else:
+            slot = len(self.slots)
+            self.slots.append(memory)
+        return slot
+
+    def retire_slot(self, slot):
+        """Tombstone a slot; its row stays intact for readers of older snapshots."""
+        self.slots[slot] = None
+        self.vector_index.remove(slot)
+        self.text_index.remove(slot)
+        self.columns.remove(slot)
+        self.retired_slots.append((self.snapshots.current.version, slot))
+
+    def reclaim_slots(self):
+        """Free retired slots that no active reader snapshot can still see."""
+        oldest_version = self.snapshots.oldest_version()
+        while self.retired_slots and self.retired_slots[0][0] < oldest_version:
+            _, slot = self.retired_slots.popleft()
+            self.delete_embedding(slot)
 
     def unwrap_list(self, list_to_unwrap):
         elements = []
@@ -92,58 +483,188 @@ class ServerMemoryManager:
         ]
         return "\n".join(filter(None, components))
 
-    def embed_all_documents(self):
-        return self.embedder.embed_docs(
+    def get_lexical_text(self, memory):
+        """Fields searched by BM25, where exact names and terms matter most."""
+        return "\n".join(
             [
-                memory["content"] + "\n" + memory["context"]["explanation"]
-                for memory in self.memories
+                memory.get("topic") or "",
+                memory.get("content") or "",
+                *map(str, self.unwrap_list(memory.get("tags") or [])),
             ]
         )
 
-    def add_embedding(self, memory):
-        new_embedding = self.embedder.embed_docs(
-            [memory["content"] + "\n" + memory["context"]["explanation"]]
-        )
-        self.embeddings = (
-            np.vstack([self.embeddings, new_embedding])
-            if len(self.embeddings) > 0
-            else new_embedding
-        )
+    def get_embedding_text(self, memory):
+        return memory["content"] + "\n" + memory["context"].get("explanation", "")
+
+    def embed_texts(self, texts):
+        """Embed texts, only running the model for texts missing from the cache."""
+        keys = [self.embedding_cache.key(text) for text in texts]
+        embeddings = [self.embedding_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing:
+            new_embeddings = self.embedder.embed_docs([texts[i] for i in missing])
+            self.embedding_cache.put_many([keys[i] for i in missing], new_embeddings)
+            for i, embedding in zip(missing, new_embeddings):
+                embeddings[i] = embedding
+
+        if not embeddings:
+            return np.empty((0, self.embedding_cache.dim or 0), dtype=np.float32)
+        return normalize(np.vstack(embeddings))
+
+    def row_label(self, memory):
+        """Identifies the memory and text a matrix row was embedded from."""
+        key = self.embedding_cache.key(self.get_embedding_text(memory))
+        return f"{memory['id']} {key}"
+
+    def load_embeddings(self, memories):
+        """Lay out memories in slots and return the slot list.
+
+        Rows of a reloaded matrix file are kept for the memories whose text
+        they were embedded from, without reading them. Other rows become
+        tombstones and the remaining memories are embedded and appended.
+        """
+        labels = [self.row_label(memory) for memory in memories]
+        missing = {label: i for i, label in enumerate(labels)}
+        slots = []
+        if self.embeddings.loaded:
+            for row in range(len(self.embeddings)):
+                i = missing.pop(self.embeddings.label(row), None)
+                slots.append(None if i is None else memories[i])
+            logger.info(f"Mapped {len(memories) - len(missing)} embeddings from disk")
+
+        missing = list(missing.values())
+        if missing:
+            cached_count = len(self.embedding_cache)
+            new_embeddings = self.embed_texts(
+                [self.get_embedding_text(memories[i]) for i in missing]
+            )
+            logger.info(
+                f"Embedded {len(self.embedding_cache) - cached_count} new or changed memories"
+            )
+            self.embeddings.append(new_embeddings, labels=[labels[i] for i in missing])
+            slots.extend(memories[i] for i in missing)
+        self.embedding_cache.compact([label.split(" ")[1] for label in labels])
+        return slots
+
+    def embed_queries(self, queries):
+        """Embed normalized queries, skipping the model for cached ones."""
+        keys = [
+            self.query_cache.key(query, self.embedder.query_prompt_name)
+            for query in queries
+        ]
+        embeddings = [self.query_cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+        if missing:
+            new_embeddings = normalize(
+                self.embedder.embed_queries([queries[i] for i in missing])
+            )
+            for i, embedding in zip(missing, new_embeddings):
+                self.query_cache.put(keys[i], embedding)
+                embeddings[i] = embedding
+        return np.vstack(embeddings)
 
     def update(self, memory_id, data):
-        for i, memory in enumerate(self.memories):
-            if memory["id"] == memory_id:
-                memory.update(data)
-                self.update_embedding(memory, i)
-                self.save()
-                return True
-        return False
-
-    def update_embedding(self, memory, i):
-        new_embedding = self.embedder.embed_docs(
-            [memory["content"] + "\n" + memory["context"]["explanation"]]
-        )
-        self.embeddings[i] = new_embedding
+        # The id is the index key and cannot be changed by an update
+        data = {key: value for key, value in data.items() if key != "id"}
+        embedded_text = new_embedding = None
+        while True:
+            # Embed a changed text before taking the write lock, so that
+            # other writes do not wait for the model
+            with self.snapshots.read() as snapshot:
+                slot = snapshot.id_to_slot.get(memory_id)
+                current = None if slot is None else snapshot.slots[slot]
+            if current is None:
+                return False
+            text = self.get_embedding_text({**current, **data})
+            if text != self.get_embedding_text(current) and text != embedded_text:
+                new_embedding = self.embed_texts([text])[0]
+                embedded_text = text
+            with self.mutation():
+                slot = self.id_to_slot.get(memory_id)
+                if slot is None:
+                    return False
+                old_text = self.get_embedding_text(self.slots[slot])
+                memory = {**self.slots[slot], **data}
+                text = self.get_embedding_text(memory)
+                if text != old_text and text != embedded_text:
+                    # Another write changed the memory while it was embedded
+                    continue
+                seq = self.columns.seq(slot)
+                if text != old_text:
+                    # The new version gets its own row so that readers of older
+                    # snapshots keep scoring the old text against the old vector
+                    self.retire_slot(slot)
+                    slot = self.allocate_slot(memory)
+                    self.id_to_slot[memory_id] = slot
+                    self.embeddings.put(slot, new_embedding, self.row_label(memory))
+                    self.vector_index.add(slot)
+                    self.pending_ids.discard(memory_id)
+                    self.failed_ids = self.failed_ids - {memory_id}
+                else:
+                    self.slots[slot] = memory
+                self.text_index.add(slot, self.get_lexical_text(memory))
+                self.columns.set(slot, memory, seq)
+                log_seq = self.store.put(memory)
+            self.store.sync(log_seq)
+            return True
 
     def delete(self, memory_id):
-        delete_index = next(
-            (i for i, m in enumerate(self.memories) if m["id"] == memory_id), -1
-        )
-        if delete_index != -1:
-            self.memories.pop(delete_index)
-            self.delete_embedding(delete_index)
-            self.save()
-            return True
-        return False
+        with self.mutation():
+            slot = self.id_to_slot.pop(memory_id, None)
+            if slot is None:
+                return False
+            self.retire_slot(slot)
+            self.pending_ids.discard(memory_id)
+            self.failed_ids = self.failed_ids - {memory_id}
+            seq = self.store.delete(memory_id)
+        self.store.sync(seq)
+        return True
+
+    def delete_embedding(self, slot):
+        if slot < len(self.embeddings):
+            # Clearing the label keeps a reloaded matrix from mapping this row
+            self.embeddings.put(slot, np.zeros(self.embeddings.dim, dtype=np.float32))
+        self.free_slots.append(slot)
 
-    def delete_embedding(self, delete_index):
-        self.embeddings = np.delete(self.embeddings, delete_index, axis=0)
+    def search(
+        self,
+        query,
+        k=10,
+        mode="vector",
+        filters=None,
+        min_score=None,
+        min_relative_score=None,
+        weights=None,
+        **search_params,
+    ):
+        """Return up to k memories most similar to query, each with its "score".
 
-    def search(self, query, k=10):
+        mode "vector" ranks by embedding similarity, "lexical" by BM25 over
+        topic, content and tags without running the model, and "hybrid" fuses
+        both rankings. Scores are on the scale of the mode: cosine
+        similarity, BM25 or fused reciprocal rank. Hits scoring below
+        min_score, or below min_relative_score times the best score, are
+        dropped, so weak queries return fewer than k memories. weights
+        re-rank the best candidates by also weighing importance, recency and
+        other attributes, see AttributeColumns.score; they default to the
+        score_weights of the manager. The score is then the weighted score,
+        where lexical and hybrid scores count as a fraction of the best
+        candidate's, and the thresholds apply to it. filters restrict the search to
+        memories matching attributes, see AttributeColumns.mask.
+        search_params are passed to the vector index, e.g. nprobe or exact
+        for the IVF index.
+        """
         print("SEARCHING FOR", query)
-        query_embedding = self.embedder.embed_query(query)
-        similarities = self.embedder.similarity(query_embedding, self.embeddings, k=k)
-        memories = [self.memories[i] for i in similarities]
+        with self.snapshots.read() as snapshot:
+            slots, scores = self.rank(
+                snapshot, [query], k, mode, search_params, filters, weights
+            )[0]
+            memories = self.scored_memories(
+                snapshot, *self.cut_off(slots, scores, min_score, min_relative_score)
+            )
+        self.record_access(memories)
 
         memory_strings = [
             f"ID: {memory['id']}\nTopic: {memory['topic']}\nContent: {memory['content']}"
@@ -152,7 +673,249 @@ class ServerMemoryManager:
         # print("FOUND MEMORIES", memory_strings)
         return memories
 
-    def filter_by_tags(self, tags):
-        if not tags:
-            return self.memories
-        return [m for m in self.memories if any(tag in m["tags"] for tag in tags)]
+    def cut_off(self, slots, scores, min_score=None, min_relative_score=None):
+        """Drop the (slots, scores) below the score thresholds; scores are sorted."""
+        threshold = -np.inf
+        if min_score is not None:
+            threshold = min_score
+        if min_relative_score is not None and len(scores) and scores[0] > 0:
+            threshold = max(threshold, scores[0] * min_relative_score)
+        keep = scores >= threshold
+        return slots[keep], scores[keep]
+
+    def scored_memories(self, snapshot, slots, scores):
+        # Published memories are shared, so the score goes on a copy
+        return [
+            dict(snapshot.slots[slot], score=score)
+            for slot, score in zip(slots.tolist(), scores.tolist())
+        ]
+
+    def rerank(self, snapshot, slots, scores, k, weights, mode):
+        """Return the k best (slots, scores) by weighted score."""
+        if mode != "vector" and len(scores) and scores.max() > 0:
+            # BM25 is unbounded and fused reciprocal ranks stay below 0.04, so
+            # they are weighed as a fraction of the best candidate's score,
+            # on the scale of cosine similarities
+            scores = scores / scores.max()
+        scores = snapshot.columns.score(
+            slots, scores, weights, recency_half_life=self.recency_half_life
+        )
+        rows = top_k(scores, k)
+        return slots[rows], scores[rows]
+
+    def rank(
+        self, snapshot, queries, k, mode, search_params, filters=None, weights=None
+    ):
+        """Return the (slots, scores) of the k best matches in snapshot for each query."""
+        if mode not in self.SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        weights = self.score_weights if weights is None else weights
+        if weights:
+            # Attributes can lift hits ranked below k by similarity alone
+            results = self.rank(
+                snapshot,
+                queries,
+                max(k, self.RERANK_DEPTH),
+                mode,
+                search_params,
+                filters,
+                weights={},
+            )
+            return [
+                self.rerank(snapshot, slots, scores, k, weights, mode)
+                for slots, scores in results
+            ]
+        # Filters become one mask over slots that the indexes apply before
+        # scoring, so filtered-out memories cost nothing to rank
+        mask = snapshot.columns.mask(**filters) if filters else None
+        if mask is not None and not mask.any():
+            empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            return [empty for _ in queries]
+        # Fusion needs deeper lists than k, or hits ranked just below k by
+        # both rankings would be lost
+        depth = max(k, self.HYBRID_DEPTH) if mode == "hybrid" else k
+        if mode != "lexical":
+            vector_results = self.vector_search(
+                snapshot, queries, depth, search_params, mask
+            )
+            if mode == "vector":
+                return vector_results
+        lexical_results = [
+            snapshot.text_index.search(query, depth, mask) for query in queries
+        ]
+        if mode == "lexical":
+            return lexical_results
+        return [
+            reciprocal_rank_fusion([vector_slots, lexical_slots], k)
+            for (vector_slots, _), (lexical_slots, _) in zip(
+                vector_results, lexical_results
+            )
+        ]
+
+    def vector_search(self, snapshot, queries, k, search_params, mask=None):
+        if self.search_worker:
+            futures = [Future() for _ in queries]
+            self.search_worker.submit(
+                [
+                    (query, k, search_params, snapshot, mask, future)
+                    for query, future in zip(queries, futures)
+                ]
+            )
+            return [future.result() for future in futures]
+        return snapshot.vector_index.search_batch(
+            self.embed_queries(queries), k, mask=mask, **search_params
+        )
+
+    def run_search_batch(self, items):
+        """Answer (query, k, search_params, snapshot, mask, future) items from vector_search()."""
+        try:
+            queries = list(dict.fromkeys(item[0] for item in items))
+            query_embeddings = self.embed_queries(queries)
+            rows = {query: i for i, query in enumerate(queries)}
+
+            # Requests on the same snapshot with the same index parameters and
+            # filter share one scoring pass
+            groups = {}
+            for item in items:
+                key = (item[3].version, tuple(sorted(item[2].items())), id(item[4]))
+                groups.setdefault(key, []).append(item)
+            for (_, params, _), group in groups.items():
+                k = max(item[1] for item in group)
+                results = group[0][3].vector_index.search_batch(
+                    query_embeddings[[rows[item[0]] for item in group]],
+                    k,
+                    mask=group[0][4],
+                    **dict(params),
+                )
+                for (_, item_k, *_, future), (slots, scores) in zip(group, results):
+                    future.set_result((slots[:item_k], scores[:item_k]))
+        except Exception as e:
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+    def search_batch(
+        self,
+        queries,
+        k=10,
+        merge=False,
+        mode="vector",
+        filters=None,
+        min_score=None,
+        min_relative_score=None,
+        weights=None,
+        **search_params,
+    ):
+        """Search several queries with one batched encode and scoring pass.
+
+        filters, weights and score thresholds apply to every query, as in
+        search().
+        Returns a dict with per-query "results" and, if merge is set, a
+        "merged" list of the distinct hits ordered by their best score.
+        """
+        logger.debug(f"Searching for {len(queries)} queries")
+        if not queries:
+            return {"results": [], "merged": []} if merge else {"results": []}
+        with self.snapshots.read() as snapshot:
+            results = [
+                self.cut_off(slots, scores, min_score, min_relative_score)
+                for slots, scores in self.rank(
+                    snapshot, queries, k, mode, search_params, filters, weights
+                )
+            ]
+            response = {
+                "results": [
+                    self.scored_memories(snapshot, slots, scores)
+                    for slots, scores in results
+                ]
+            }
+            if merge:
+                best_scores = {}
+                for slots, scores in results:
+                    for slot, score in zip(slots.tolist(), scores.tolist()):
+                        if score > best_scores.get(slot, float("-inf")):
+                            best_scores[slot] = score
+                merged = sorted(best_scores, key=best_scores.get, reverse=True)
+                response["merged"] = self.scored_memories(
+                    snapshot,
+                    np.array(merged, dtype=np.int64),
+                    np.array([best_scores[slot] for slot in merged]),
+                )
+        self.record_access([memory for hits in response["results"] for memory in hits])
+        return response
+
+    def measure_recall(self, sample_size=100, k=10, **search_params):
+        """Recall@k of the vector index against exact search.
+
+        Stored memories serve as the queries, so this needs no query log.
+        """
+        with self.snapshots.read() as snapshot:
+            index = snapshot.vector_index
+            live_slots = np.flatnonzero(index.live.view()[: len(index.embeddings)])
+            if not len(live_slots):
+                return None
+            rng = np.random.default_rng(0)
+            sample = rng.choice(
+                live_slots, size=min(sample_size, len(live_slots)), replace=False
+            )
+            return measure_recall(
+                index, index.embeddings.view()[sample], k, **search_params
+            )
+
+    def list_memories(self, tags=None, match="any", cursor=0, limit=100):
+        """Return a page of memories with any or all of the tags, in store order.
+
+        cursor is the value returned with the previous page, 0 for the first
+        one. Returns (memories, next_cursor), where next_cursor is None after
+        the last page. Memories updated or added while paging do not shift
+        later pages; added ones are listed at the end.
+        """
+        with self.snapshots.read() as snapshot:
+            return self.read_page(snapshot, tags, match, cursor, limit)
+
+    def iter_memories(self, tags=None, match="any", cursor=0, page_size=256):
+        """Yield the memories with any or all of the tags, a page at a time.
+
+        The whole listing reads one snapshot, so it is consistent, and only
+        one page of memories is collected at a time.
+        """
+        with self.snapshots.read() as snapshot:
+            while cursor is not None:
+                memories, cursor = self.read_page(
+                    snapshot, tags, match, cursor, page_size
+                )
+                yield from memories
+
+    def read_page(self, snapshot, tags, match, cursor, limit):
+        # Cursors are insertion sequence numbers rather than slots, which
+        # are reused and change when an update re-embeds a memory
+        mask = snapshot.columns.mask(tags=tags or None, tag_match=match)
+        seqs = snapshot.columns.seqs()
+        slots = np.flatnonzero(mask & (seqs >= cursor))
+        slots = slots[top_k(-seqs[slots], limit + 1)]
+        next_cursor = int(seqs[slots[limit]]) if len(slots) > limit else None
+        return [snapshot.slots[slot] for slot in slots[:limit].tolist()], next_cursor
+
+    @property
+    def memory_count(self):
+        return len(self.snapshots.current.id_to_slot)
+
+    def filter_by_tags(self, tags, match="any"):
+        """Return memories with any or all of the tags, in store order."""
+        snapshot = self.snapshots.current
+        seqs = snapshot.columns.seqs()
+        if tags:
+            # Only the memories in the tag postings are looked at and sorted
+            slots = snapshot.columns.tag_slots(tags, match)
+            slots = slots[seqs[slots] >= 0]
+        else:
+            slots = np.flatnonzero(seqs >= 0)
+        return self.in_store_order(snapshot, slots)
+
+    @staticmethod
+    def in_store_order(snapshot, slots):
+        # Sequence order, the same as list_memories and iter_memories. Slot
+        # order differs once a slot is reused.
+        seqs = snapshot.columns.seqs()
+        slots = slots[np.argsort(seqs[slots])]
+        return [snapshot.slots[slot] for slot in slots.tolist()]
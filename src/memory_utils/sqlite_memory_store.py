@@ -0,0 +1,243 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from src.memory_utils.memory_log_store import MemoryLogStore
+from src.memory_utils.tag_index import normalize_all
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    id TEXT PRIMARY KEY,
+    ai_persona TEXT,
+    timestamp TEXT,
+    importance REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS memories_ai_persona ON memories (ai_persona);
+CREATE INDEX IF NOT EXISTS memories_timestamp ON memories (timestamp);
+CREATE INDEX IF NOT EXISTS memories_importance ON memories (importance);
+CREATE TABLE IF NOT EXISTS memory_tags (
+    tag TEXT NOT NULL,
+    memory_id TEXT NOT NULL REFERENCES memories (id) ON DELETE CASCADE,
+    PRIMARY KEY (tag, memory_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS memory_tags_memory_id ON memory_tags (memory_id);
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model_id TEXT NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_model_id ON embeddings (model_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def connect(db_path, synchronous="FULL"):
+    connection = sqlite3.connect(db_path, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(f"PRAGMA synchronous={synchronous}")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SqliteMemoryStore:
+    """SQLite persistence for memories, with the same interface as MemoryLogStore.
+
+    Each memory is a row holding its JSON document plus indexed id,
+    ai_persona, timestamp and importance columns, and one memory_tags row per
+    normalized tag. Every put, put_many and delete is its own transaction and
+    is durable when it returns, so sync() has nothing to wait for. The
+    database runs in WAL mode; save() checkpoints the WAL instead of writing
+    a snapshot.
+
+    If migrate_from names a YAML store, that store (including its pending
+    log) is imported on the first load; the YAML files are left untouched.
+    """
+
+    def __init__(self, file_path="memories.db", migrate_from=None, synchronous="FULL"):
+        self.file_path = file_path
+        self.migrate_from = migrate_from
+        self.connection = connect(file_path, synchronous)
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.migrate_from and not self._get_meta("migrated_from"):
+            self._migrate()
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM memories ORDER BY rowid")
+            return [json.loads(data) for (data,) in rows]
+
+    def _get_meta(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _migrate(self):
+        if os.path.exists(self.migrate_from) or os.path.exists(
+            self.migrate_from + ".log"
+        ):
+            yaml_store = MemoryLogStore(self.migrate_from)
+            memories = yaml_store.load()
+            yaml_store.close()
+        else:
+            memories = []
+        with self.lock, self.connection:
+            self._put_rows(memories)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from', ?)",
+                (self.migrate_from,),
+            )
+        if memories:
+            logger.info(
+                f"Migrated {len(memories)} memories from {self.migrate_from} to {self.file_path}"
+            )
+
+    def _put_rows(self, memories):
+        # An upsert keeps the rowid, so updated memories keep their load order
+        self.connection.executemany(
+            "INSERT INTO memories (id, ai_persona, timestamp, importance, data) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+            "ai_persona = excluded.ai_persona, timestamp = excluded.timestamp, "
+            "importance = excluded.importance, data = excluded.data",
+            [
+                (
+                    memory["id"],
+                    memory.get("ai_persona"),
+                    memory.get("timestamp"),
+                    memory.get("importance"),
+                    json.dumps(memory, ensure_ascii=False, default=str),
+                )
+                for memory in memories
+            ],
+        )
+        self.connection.executemany(
+            "DELETE FROM memory_tags WHERE memory_id = ?",
+            [(memory["id"],) for memory in memories],
+        )
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO memory_tags (tag, memory_id) VALUES (?, ?)",
+            [
+                (tag, memory["id"])
+                for memory in memories
+                for tag in normalize_all(memory.get("tags"))
+            ],
+        )
+
+    def put(self, memory):
+        return self.put_many([memory])
+
+    def put_many(self, memories):
+        with self.lock, self.connection:
+            self._put_rows(memories)
+        return 0
+
+    def delete(self, memory_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
+        return 0
+
+    def sync(self, seq):
+        pass
+
+    def needs_compaction(self, min_records=1000):
+        return False
+
+    def rotate_log(self):
+        pass
+
+    def write_snapshot(self, memories):
+        """The rows are already current; fold the WAL back into the database."""
+        with self.lock:
+            self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class SqliteEmbeddingCache:
+    """Document embedding cache stored as float32 BLOBs in the memory database.
+
+    Drop-in for EmbeddingCache, with the same keys, so that vectors are kept
+    next to the memories instead of in separate files.
+    """
+
+    def __init__(self, model_id: str, db_path: str = "memories.db"):
+        self.model_id = model_id
+        self.connection = connect(db_path)
+        self.lock = threading.Lock()
+        row = self.connection.execute(
+            "SELECT length(vector) FROM embeddings WHERE model_id = ? LIMIT 1",
+            (model_id,),
+        ).fetchone()
+        self.dim = row[0] // np.dtype(np.float32).itemsize if row else None
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model_id = ?", (self.model_id,)
+            ).fetchone()[0]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_id}\n{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def put_many(self, keys: list[str], vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(keys) == 0:
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}"
+            )
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model_id, vector) VALUES (?, ?, ?)",
+                [
+                    (key, self.model_id, vector.tobytes())
+                    for key, vector in zip(keys, vectors)
+                ],
+            )
+
+    def compact(self, live_keys: list[str], max_dead_ratio: float = 0.5):
+        """Delete vectors of texts no longer in the store once they dominate the table."""
+        count = len(self)
+        live_keys = set(live_keys)
+        with self.lock, self.connection:
+            stored_keys = [
+                key
+                for (key,) in self.connection.execute(
+                    "SELECT key FROM embeddings WHERE model_id = ?", (self.model_id,)
+                )
+            ]
+            dead_keys = [key for key in stored_keys if key not in live_keys]
+            if count == 0 or len(dead_keys) <= count * max_dead_ratio:
+                return
+            self.connection.executemany(
+                "DELETE FROM embeddings WHERE key = ?", [(key,) for key in dead_keys]
+            )
+        logger.info(
+            f"Compacted embedding cache from {count} to {count - len(dead_keys)} entries"
+        )
@@ -0,0 +1,16 @@
+def normalize(tag):
+    return str(tag).replace("_", " ").lower().strip()
+
+
+def normalize_all(tags):
+    """Set of normalized tags, as stored in the tag postings of memories."""
+    # Dict tags are flattened the same way as ServerMemoryManager.unwrap_list
+    normalized = set()
+    for tag in tags or []:
+        if isinstance(tag, dict):
+            normalized.update(
+                normalize(f"{key}: {value}") for key, value in tag.items()
+            )
+        else:
+            normalized.add(normalize(tag))
+    return normalized
@@ -0,0 +1,146 @@
+from collections import Counter
+import copy
+import math
+import re
+
+import numpy as np
+
+from src.memory_utils.segmented import SEGMENT_SIZE, SegmentedDict
+from src.memory_utils.vector_index import fit_mask, top_k
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class TextIndex:
+    """Incremental BM25 index from term to the slots whose text contains it.
+
+    Like the vector indexes it is keyed by slot and handed to readers through
+    snapshot(). The postings of a term are split by slot segment, so later
+    add/remove calls copy only the segments they change instead of
+    modifying ones a snapshot may be reading.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, segment_size=SEGMENT_SIZE):
+        self.k1 = k1
+        self.b = b
+        self.segment_size = segment_size
+        # term -> {slot segment: {slot: (term frequency, document length)}}
+        self.postings = SegmentedDict()
+        # slot -> term frequencies, only read by the writer
+        self.doc_terms = SegmentedDict()
+        self.doc_count = 0
+        self.total_length = 0
+        self.shared = False
+        # Terms and (term, segment) postings copied since the last snapshot
+        self.owned_terms = set()
+        self.owned_segments = set()
+
+    def __len__(self):
+        return self.doc_count
+
+    def snapshot(self):
+        self.shared = True
+        snapshot = copy.copy(self)
+        snapshot.postings = self.postings.snapshot()
+        snapshot.doc_terms = self.doc_terms.snapshot()
+        return snapshot
+
+    def restore(self, snapshot):
+        """Roll back to a snapshot taken earlier."""
+        vars(self).update(vars(snapshot.snapshot()))
+
+    def _unshare(self):
+        if self.shared:
+            self.owned_terms = set()
+            self.owned_segments = set()
+            self.shared = False
+
+    def _posting(self, term, slot):
+        """Segments of term and its posting in the segment of slot, both writable."""
+        if term not in self.owned_terms:
+            self.postings[term] = dict(self.postings.get(term, {}))
+            self.owned_terms.add(term)
+        segments = self.postings[term]
+        segment = slot // self.segment_size
+        if (term, segment) not in self.owned_segments:
+            segments[segment] = dict(segments.get(segment, {}))
+            self.owned_segments.add((term, segment))
+        return segments, segments[segment]
+
+    def add(self, slot, text):
+        self.remove(slot)
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        for term, frequency in terms.items():
+            self._posting(term, slot)[1][slot] = (frequency, length)
+        self.doc_terms[slot] = terms
+        self.doc_count += 1
+        self.total_length += length
+
+    def remove(self, slot):
+        self._unshare()
+        terms = self.doc_terms.pop(slot)
+        if terms is None:
+            return
+        segment = slot // self.segment_size
+        for term in terms:
+            segments, posting = self._posting(term, slot)
+            posting.pop(slot, None)
+            if not posting:
+                del segments[segment]
+                self.owned_segments.discard((term, segment))
+            if not segments:
+                self.postings.pop(term)
+                self.owned_terms.discard(term)
+        self.doc_count -= 1
+        self.total_length -= sum(terms.values())
+
+    def search(self, query, k, mask=None):
+        """Return the (slots, scores) of the k best BM25 matches for query.
+
+        With a boolean mask over slots, only slots it selects are returned.
+        """
+        doc_count = self.doc_count
+        if not doc_count:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        average_length = self.total_length / doc_count
+        scores = Counter()
+        for term in set(tokenize(query)):
+            segments = self.postings.get(term)
+            if not segments:
+                continue
+            matches = sum(map(len, segments.values()))
+            idf = math.log(1 + (doc_count - matches + 0.5) / (matches + 0.5))
+            for posting in segments.values():
+                for slot, (frequency, length) in posting.items():
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[slot] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        if not scores:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        slots = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        values = np.fromiter(scores.values(), dtype=np.float32, count=len(scores))
+        if mask is not None:
+            keep = fit_mask(mask, int(slots.max()) + 1)[slots]
+            slots, values = slots[keep], values[keep]
+        rows = top_k(values, k)
+        return slots[rows], values[rows]
+
+
+def reciprocal_rank_fusion(rankings, k, c=60):
+    """Fuse ranked slot lists by summing 1 / (c + rank) over the lists.
+
+    Returns the (slots, scores) of the k best fused results.
+    """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, slot in enumerate(ranking.tolist()):
+            scores[slot] += 1 / (c + rank + 1)
+    best = scores.most_common(k)
+    return (
+        np.array([slot for slot, _ in best], dtype=np.int64),
+        np.array([score for _, score in best], dtype=np.float32),
+    )
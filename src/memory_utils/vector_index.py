@@ -0,0 +1,503 @@
+import copy
+from itertools import chain
+import logging
+
+import numpy as np
+
+from src.memory_embeddings.base_embeddings import normalize
+from src.memory_utils.segmented import SegmentedArray
+
+logger = logging.getLogger(__name__)
+
+
+def top_k(scores, k):
+    """Indices of the k highest scores, best first, without sorting all of them."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def fit_mask(mask, size):
+    """A slot mask cut or padded with False to size entries."""
+    if len(mask) >= size:
+        return mask[:size]
+    fitted = np.zeros(size, dtype=bool)
+    fitted[: len(mask)] = mask
+    return fitted
+
+
+class ExactIndex:
+    """Brute-force cosine search over every live row of an EmbeddingMatrix.
+
+    Rows are expected to be unit length. Indexes are told about rows with
+    add/update/remove after the row has been written to the matrix.
+
+    Searches take an optional boolean ``mask`` over slots; only rows it
+    selects are returned, and the exact and compressed indexes only score
+    those rows.
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.live = SegmentedArray(bool, False)
+        self.live_count = 0
+        # Set while the structures are shared with a snapshot, see snapshot()
+        self.shared = False
+
+    def __len__(self):
+        return self.live_count
+
+    def __contains__(self, slot):
+        return bool(self.live.get(slot))
+
+    def snapshot(self):
+        """Frozen copy for readers that later add/remove calls do not affect.
+
+        Structures are shared until the next mutation, which copies the parts
+        it changes first.
+        """
+        self.shared = True
+        snapshot = copy.copy(self)
+        snapshot.embeddings = self.embeddings.snapshot()
+        snapshot.live = self.live.snapshot()
+        return snapshot
+
+    def restore(self, snapshot):
+        """Roll back to a snapshot taken earlier, keeping the current matrix."""
+        embeddings = self.embeddings
+        vars(self).update(vars(snapshot.snapshot()))
+        self.embeddings = embeddings
+
+    def _unshare(self):
+        self.shared = False
+
+    def add(self, slot):
+        self._unshare()
+        if not self.live.get(slot):
+            self.live_count += 1
+        self.live[slot] = True
+
+    def update(self, slot):
+        self.add(slot)
+
+    def remove(self, slot):
+        self._unshare()
+        # Pending memories may never have been added
+        if self.live.get(slot):
+            self.live_count -= 1
+            self.live[slot] = False
+
+    def needs_training(self):
+        return False
+
+    def train(self):
+        self.install(self.fit())
+
+    def fit(self):
+        """Training result for install(); only reads, so it may run on a snapshot."""
+        return None
+
+    def install(self, trained):
+        pass
+
+    def search(self, query, k, mask=None, **params):
+        """Return the (slots, scores) of the k rows most similar to query."""
+        if mask is not None:
+            return ExactIndex.search_batch(self, query[None, :], k, mask=mask)[0]
+        if not self.live_count:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        matrix = self.embeddings.view()
+        # Rows written but not yet added to the index are left out
+        live = self.live.view()[: len(matrix)]
+        scores = matrix[: len(live)] @ query
+        scores[~live] = -np.inf
+        rows = top_k(scores, k)
+        rows = rows[np.isfinite(scores[rows])]
+        return rows, scores[rows]
+
+    def search_batch(self, queries, k, mask=None, **params):
+        """Search several queries, scoring all of them with one matrix product."""
+        if not self.live_count:
+            empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            return [empty for _ in queries]
+        matrix = self.embeddings.view()
+        live = self.live.view()[: len(matrix)]
+        if mask is not None:
+            # Gather the rows passing the filter instead of scoring them all
+            slots = np.flatnonzero(live & fit_mask(mask, len(live)))
+            scores = queries @ matrix[slots].T
+            results = []
+            for query_scores in scores:
+                rows = top_k(query_scores, k)
+                results.append((slots[rows], query_scores[rows]))
+            return results
+        scores = queries @ matrix[: len(live)].T
+        scores[:, ~live] = -np.inf
+        results = []
+        for query_scores in scores:
+            rows = top_k(query_scores, k)
+            rows = rows[np.isfinite(query_scores[rows])]
+            results.append((rows, query_scores[rows]))
+        return results
+
+
+class IVFIndex(ExactIndex):
+    """Inverted-file approximate index.
+
+    Rows are bucketed by their nearest spherical k-means centroid and a query
+    only scores the rows in its ``nprobe`` closest buckets. Inserts are
+    assigned to the nearest existing centroid; the centroids are retrained
+    once the store has doubled since the last training. Stores smaller than
+    ``min_train_size`` are searched exactly.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        nprobe=8,
+        min_train_size=4096,
+        kmeans_iterations=10,
+        seed=0,
+    ):
+        super().__init__(embeddings)
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.kmeans_iterations = kmeans_iterations
+        self.rng = np.random.default_rng(seed)
+        # (centroids, lists, assignments), swapped as a whole by train();
+        # assignments holds the bucket of each slot, -1 if it has none
+        self.ivf = None
+        self.trained_size = 0
+        # Buckets copied since the last snapshot, which may be changed in place
+        self.owned_buckets = set()
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        if self.ivf is not None:
+            centroids, lists, assignments = self.ivf
+            snapshot.ivf = (centroids, lists, assignments.snapshot())
+        return snapshot
+
+    def _unshare(self):
+        if self.shared and self.ivf is not None:
+            centroids, lists, assignments = self.ivf
+            self.ivf = (centroids, list(lists), assignments)
+            self.owned_buckets = set()
+        super()._unshare()
+
+    def _bucket(self, bucket):
+        lists = self.ivf[1]
+        if bucket not in self.owned_buckets:
+            lists[bucket] = set(lists[bucket])
+            self.owned_buckets.add(bucket)
+        return lists[bucket]
+
+    def add(self, slot):
+        super().add(slot)
+        if self.ivf is not None:
+            centroids, _, assignments = self.ivf
+            bucket = int(np.argmax(centroids @ self.embeddings.view()[slot]))
+            self._bucket(bucket).add(slot)
+            assignments[slot] = bucket
+
+    def update(self, slot):
+        self.remove(slot)
+        self.add(slot)
+
+    def remove(self, slot):
+        super().remove(slot)
+        if self.ivf is not None:
+            assignments = self.ivf[2]
+            bucket = int(assignments.get(slot))
+            if bucket >= 0:
+                assignments[slot] = -1
+                self._bucket(bucket).discard(slot)
+
+    def needs_training(self):
+        return (
+            self.live_count >= self.min_train_size
+            and self.live_count >= 2 * self.trained_size
+        )
+
+    def fit(self):
+        """Run k-means over the live rows and bucket them, leaving the index as is.
+
+        Training a snapshot this way keeps the writer free; install() then
+        applies the result to the writer's index.
+        """
+        matrix = self.embeddings.view()
+        slots = np.flatnonzero(self.live.view()[: len(matrix)])
+        n_lists = max(1, int(np.sqrt(len(slots))))
+
+        sample = self.rng.choice(
+            slots, size=min(len(slots), n_lists * 64), replace=False
+        )
+        vectors = matrix[sample]
+        centroids = vectors[self.rng.choice(len(vectors), n_lists, replace=False)]
+        for _ in range(self.kmeans_iterations):
+            nearest = np.argmax(vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, vectors)
+            # Keep the previous centroid for buckets that ended up empty
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize(sums)
+        return centroids, slots, self.assign_buckets(matrix, slots, centroids)
+
+    @staticmethod
+    def assign_buckets(matrix, slots, centroids):
+        """Bucket of each of the rows in slots."""
+        return np.concatenate(
+            [
+                np.argmax(matrix[chunk] @ centroids.T, axis=1)
+                for chunk in np.array_split(slots, max(1, len(slots) // 65536))
+            ]
+        )
+
+    def install(self, trained):
+        """Swap in the centroids and buckets from fit().
+
+        The index may have changed since fit() read it: rows removed since
+        are dropped and rows added since are bucketed here. Rows must not
+        be rewritten in between, which holding the snapshot fit() ran on
+        ensures for ServerMemoryManager.
+        """
+        centroids, slots, buckets = trained
+        matrix = self.embeddings.view()
+        live = fit_mask(self.live.view(), len(matrix))
+        kept = live[slots]
+        slots, buckets = slots[kept], buckets[kept]
+        trained_rows = np.zeros(len(matrix), dtype=bool)
+        trained_rows[slots] = True
+        added = np.flatnonzero(live & ~trained_rows)
+        if len(added):
+            slots = np.concatenate([slots, added])
+            buckets = np.concatenate(
+                [buckets, self.assign_buckets(matrix, added, centroids)]
+            )
+
+        n_lists = len(centroids)
+        lists = [set() for _ in range(n_lists)]
+        for slot, bucket in zip(slots.tolist(), buckets.tolist()):
+            lists[bucket].add(slot)
+        assignments = np.full(len(matrix), -1, dtype=np.int32)
+        assignments[slots] = buckets
+        self.ivf = (centroids, lists, SegmentedArray(np.int32, -1, assignments))
+        self.owned_buckets = set(range(n_lists))
+        self.trained_size = len(slots)
+        logger.info(
+            f"Trained IVF index with {n_lists} lists over {len(slots)} rows, "
+            f"{len(added)} of them added during training"
+        )
+
+    def search(self, query, k, nprobe=None, exact=False, mask=None, **params):
+        ivf = self.ivf
+        if exact or ivf is None or self.scan_masked(mask, nprobe):
+            return super().search(query, k, mask=mask)
+
+        centroids, lists, _ = ivf
+        probes = top_k(centroids @ query, min(nprobe or self.nprobe, len(centroids)))
+        candidates = np.fromiter(
+            chain.from_iterable([lists[probe] for probe in probes]), dtype=np.int64
+        )
+        if mask is not None:
+            candidates = candidates[fit_mask(mask, len(self.live))[candidates]]
+        # Fetch the view after the candidates so that every candidate row is in it
+        scores = self.embeddings.view()[candidates] @ query
+        rows = top_k(scores, k)
+        return candidates[rows], scores[rows]
+
+    def search_batch(self, queries, k, nprobe=None, exact=False, mask=None, **params):
+        if exact or self.ivf is None or self.scan_masked(mask, nprobe):
+            return super().search_batch(queries, k, mask=mask)
+        # Each query probes its own buckets, so candidates are scored per query
+        return [self.search(query, k, nprobe=nprobe, mask=mask) for query in queries]
+
+    def scan_masked(self, mask, nprobe=None):
+        """Whether scoring every row of mask costs no more than probing buckets.
+
+        Selective filters are answered exactly this way, where probing would
+        mostly find rows the filter rejects.
+        """
+        if mask is None or self.ivf is None:
+            return False
+        n_lists = len(self.ivf[0])
+        probed = min(nprobe or self.nprobe, n_lists) * self.live_count / n_lists
+        return np.count_nonzero(mask) <= probed
+
+
+# Number of set bits in each byte value, for Hamming distances on packed codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int32)
+
+
+class QuantizedIndex(ExactIndex):
+    """Brute-force index over compressed codes with full-precision rescoring.
+
+    Every live row is scored on its code, then the best
+    ``k * rescore_factor`` rows are rescored against the float32 matrix. The
+    codes stay in memory while the matrix, if memory-mapped, is only read for
+    the shortlist. Modes:
+
+    - ``float16``: half precision, 2 bytes per dimension
+    - ``int8``: scalar quantization with one scale per row, 1 byte per dimension
+    - ``binary``: sign bits scored by Hamming distance, 1 bit per dimension
+    """
+
+    MODES = ("float16", "int8", "binary")
+
+    def __init__(self, embeddings, mode="int8", rescore_factor=4, chunk_size=65536):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        super().__init__(embeddings)
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+        self.chunk_size = chunk_size
+        self.codes = None
+        self.scales = np.zeros(0, dtype=np.float32)
+
+    def encode(self, vectors):
+        vectors = np.atleast_2d(vectors)
+        if self.mode == "float16":
+            return vectors.astype(np.float16), None
+        if self.mode == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            codes = np.round(vectors / scales[:, None]).astype(np.int8)
+            return codes, scales.astype(np.float32)
+        return np.packbits(vectors > 0, axis=1), None
+
+    def add(self, slot):
+        super().add(slot)
+        code, scale = self.encode(self.embeddings.view()[slot])
+        if self.codes is None or slot >= len(self.codes):
+            # Rows of slots that are not live are never read, so growing
+            # into a new array leaves snapshots of the old one intact
+            size = max(slot + 1, 2 * (0 if self.codes is None else len(self.codes)))
+            codes = np.zeros((size, code.shape[1]), dtype=code.dtype)
+            scales = np.ones(size, dtype=np.float32)
+            if self.codes is not None:
+                codes[: len(self.codes)] = self.codes
+                scales[: len(self.scales)] = self.scales
+            self.codes, self.scales = codes, scales
+        self.codes[slot] = code[0]
+        if scale is not None:
+            self.scales[slot] = scale[0]
+
+    def update(self, slot):
+        self.add(slot)
+
+    def encode_queries(self, queries):
+        return self.encode(queries)[0] if self.mode == "binary" else queries
+
+    def code_chunk(self, start, count, slots=None):
+        stop = min(start + self.chunk_size, count)
+        if slots is None:
+            return self.codes[start:stop]
+        return self.codes[slots[start:stop]]
+
+    def approximate_scores(self, queries, slots=None):
+        """Scores of queries against the coded rows, higher is more similar.
+
+        Every row is scored unless slots selects some of them.
+        """
+        count = min(len(self.live), len(self.codes)) if slots is None else len(slots)
+        query_codes = self.encode_queries(queries)
+        if self.mode == "binary":
+            scores = np.empty((len(queries), count), dtype=np.float32)
+            for start in range(0, count, self.chunk_size):
+                chunk = self.code_chunk(start, count, slots)
+                for i, query_code in enumerate(query_codes):
+                    scores[i, start : start + len(chunk)] = -POPCOUNT[
+                        chunk ^ query_code
+                    ].sum(axis=1)
+            return scores
+        # Convert a chunk at a time so that the codes are never fully widened
+        scores = np.concatenate(
+            [
+                query_codes
+                @ self.code_chunk(start, count, slots).astype(np.float32, copy=False).T
+                for start in range(0, count, self.chunk_size)
+            ],
+            axis=1,
+        )
+        if self.mode == "int8":
+            scores *= self.scales[:count] if slots is None else self.scales[slots]
+        return scores
+
+    def search(self, query, k, **params):
+        return self.search_batch(query[None, :], k, **params)[0]
+
+    def search_batch(
+        self, queries, k, rescore_factor=None, exact=False, mask=None, **params
+    ):
+        if exact or not self.live_count:
+            return super().search_batch(queries, k, mask=mask)
+        matrix = self.embeddings.view()
+        slots = None
+        live = self.live.view()
+        if mask is not None:
+            count = min(len(live), len(self.codes))
+            slots = np.flatnonzero(live[:count] & fit_mask(mask, count))
+        scores = self.approximate_scores(queries, slots)
+        if slots is None:
+            scores[:, ~live[: scores.shape[1]]] = -np.inf
+        shortlist_size = k * (rescore_factor or self.rescore_factor)
+        results = []
+        for query, query_scores in zip(queries, scores):
+            shortlist = top_k(query_scores, shortlist_size)
+            shortlist = shortlist[np.isfinite(query_scores[shortlist])]
+            if slots is not None:
+                shortlist = slots[shortlist]
+            exact_scores = matrix[shortlist] @ query
+            rows = top_k(exact_scores, k)
+            results.append((shortlist[rows], exact_scores[rows]))
+        return results
+
+
+class MatryoshkaIndex(QuantizedIndex):
+    """Two-stage search that shortlists on a truncated prefix of each vector.
+
+    Stella is trained so that the leading dimensions of an embedding are a
+    smaller embedding in their own right. The first ``dims`` components of
+    every row are renormalized and kept as float32, so the first stage
+    runs on BLAS like exact search, and the shortlist is rescored with the
+    full vectors.
+    """
+
+    MODES = ("matryoshka",)
+
+    def __init__(self, embeddings, dims=256, rescore_factor=4, chunk_size=65536):
+        super().__init__(embeddings, "matryoshka", rescore_factor, chunk_size)
+        self.dims = dims
+
+    def encode(self, vectors):
+        return self.encode_queries(vectors), None
+
+    def encode_queries(self, queries):
+        return normalize(np.atleast_2d(queries)[:, : self.dims])
+
+
+def measure_recall(index, queries, k=10, **search_params):
+    """Fraction of the exact top k over the index's live rows that it returns."""
+    exact = ExactIndex(index.embeddings)
+    exact.live, exact.live_count = index.live, index.live_count
+    hits = 0
+    for (slots, _), (expected, _) in zip(
+        index.search_batch(queries, k, **search_params), exact.search_batch(queries, k)
+    ):
+        hits += len(set(slots.tolist()) & set(expected.tolist()))
+    return hits / max(1, sum(min(k, index.live_count) for _ in queries))
+
+
+def create_vector_index(name, embeddings, **kwargs):
+    if name == "exact":
+        return ExactIndex(embeddings)
+    if name == "ivf":
+        return IVFIndex(embeddings, **kwargs)
+    if name == "matryoshka":
+        return MatryoshkaIndex(embeddings, **kwargs)
+    if name in QuantizedIndex.MODES:
+        return QuantizedIndex(embeddings, mode=name, **kwargs)
+    raise ValueError(f"Unknown vector index: {name}")
@@ -0,0 +1,90 @@
+from src.memory_utils.attribute_columns import AttributeColumns
+
+
+def memory(persona, timestamp, importance, tags=(), source="user", emotional_tags=()):
+    return {
+        "ai_persona": persona,
+        "timestamp": timestamp,
+        "importance": importance,
+        "tags": list(tags),
+        "source": source,
+        "emotional_tags": list(emotional_tags),
+    }
+
+
+def matching(columns, **filters):
+    return columns.mask(**filters).nonzero()[0].tolist()
+
+
+def test_mask_combines_filters():
+    columns = AttributeColumns(segment_size=2)
+    columns.set(0, memory("Ada", "2024-01-01T10:00:00", 0.9, ["music"]))
+    columns.set(1, memory("Bob", "2024-02-01T10:00:00", 0.2, ["music", "work"]))
+    columns.set(2, memory("Ada", "2024-03-01T10:00:00", 0.5, ["Work"], "ai", ["joy"]))
+
+    assert matching(columns) == [0, 1, 2]
+    assert matching(columns, ai_persona="Ada") == [0, 2]
+    assert matching(columns, ai_persona=["Bob", "Nobody"]) == [1]
+    assert matching(columns, min_importance=0.5) == [0, 2]
+    assert matching(columns, since="2024-01-15", until="2024-02-15") == [1]
+    assert matching(columns, tags=["work"]) == [1, 2]
+    assert matching(columns, tags=["music", "work"], tag_match="all") == [1]
+    assert matching(columns, source="ai", emotional_tags=["Joy"]) == [2]
+    assert matching(columns, ai_persona="Ada", tags=["music"]) == [0]
+
+
+def test_tag_slots_read_postings():
+    columns = AttributeColumns(segment_size=2)
+    columns.set(0, memory("Ada", "2024-01-01T10:00:00", 0.9, ["music"]))
+    columns.set(1, memory("Bob", "2024-02-01T10:00:00", 0.2, ["music", "work"]))
+    columns.set(2, memory("Ada", "2024-03-01T10:00:00", 0.5, ["Work"]))
+    columns.remove(1)
+
+    assert sorted(columns.tag_slots(["music", "work"]).tolist()) == [0, 2]
+    assert columns.tag_slots(["work", "music"], "all").tolist() == []
+    assert columns.tag_slots(["unknown"]).tolist() == []
+
+
+def test_snapshot_ignores_later_changes():
+    columns = AttributeColumns()
+    columns.set(0, memory("Ada", "2024-01-01T10:00:00", 0.9, ["music"]))
+    snapshot = columns.snapshot()
+    columns.remove(0)
+    columns.set(1, memory("Ada", "2024-01-01T10:00:00", 0.9, ["music"]))
+    assert matching(snapshot, ai_persona="Ada", tags=["music"]) == [0]
+    assert matching(columns, ai_persona="Ada", tags=["music"]) == [1]
+
+
+def test_writes_copy_only_changed_segments():
+    columns = AttributeColumns(segment_size=2)
+    for slot in range(4):
+        columns.set(slot, memory("Ada", "2024-01-01T10:00:00", 0.5, ["music"]))
+    snapshot = columns.snapshot()
+    columns.set(3, memory("Bob", "2024-01-01T10:00:00", 0.5, ["work"]))
+
+    assert matching(snapshot, tags=["music"]) == [0, 1, 2, 3]
+    assert matching(columns, tags=["music"]) == [0, 1, 2]
+    assert matching(columns, ai_persona="Bob", tags=["work"]) == [3]
+    persona = columns.columns["persona"]
+    assert persona.segments[0] is snapshot.columns["persona"].segments[0]
+    assert columns.tags["music"][0] is snapshot.tags["music"][0]
+
+
+def test_weighted_score():
+    columns = AttributeColumns()
+    columns.set(0, memory("Ada", 1000.0, 0.1))
+    columns.set(1, memory("Ada", 1000.0 - 86400, 0.9))
+    slots = [0, 1]
+    similarities = [0.8, 0.7]
+
+    assert columns.score(slots, similarities, {}).tolist() == [0.8, 0.7]
+    scores = columns.score(slots, similarities, {"importance": 1.0})
+    assert scores[1] > scores[0]
+    scores = columns.score(
+        slots,
+        similarities,
+        {"similarity": 0, "recency": 1.0},
+        now=1000.0,
+        recency_half_life=86400,
+    )
+    assert scores.tolist() == [1.0, 0.5]
@@ -0,0 +1,99 @@
+import threading
+
+import numpy as np
+import pytest
+
+from src.memory_embeddings.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "embedding_cache")
+
+
+def test_put_and_reload(cache_dir):
+    cache = EmbeddingCache("model@rev", cache_dir)
+    keys = [cache.key("first"), cache.key("second")]
+    vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+    cache.put_many(keys, vectors)
+
+    reloaded = EmbeddingCache("model@rev", cache_dir)
+    assert len(reloaded) == 2
+    assert isinstance(reloaded.vectors, np.memmap)
+    np.testing.assert_array_equal(reloaded.get(keys[1]), vectors[1])
+    assert reloaded.get(reloaded.key("third")) is None
+
+
+def test_key_depends_on_model(cache_dir):
+    assert EmbeddingCache("a@1", cache_dir).key("text") != EmbeddingCache(
+        "a@2", cache_dir
+    ).key("text")
+
+
+def test_compact_drops_stale_entries(cache_dir):
+    cache = EmbeddingCache("model@rev", cache_dir)
+    keys = [cache.key(str(i)) for i in range(4)]
+    vectors = np.random.rand(4, 3).astype(np.float32)
+    cache.put_many(keys, vectors)
+
+    cache.compact([keys[2]])
+    assert len(cache) == 1
+    np.testing.assert_array_equal(cache.get(keys[2]), vectors[2])
+
+    reloaded = EmbeddingCache("model@rev", cache_dir)
+    assert len(reloaded) == 1
+    np.testing.assert_array_equal(reloaded.get(keys[2]), vectors[2])
+
+
+def test_truncated_tail_is_ignored(cache_dir):
+    cache = EmbeddingCache("model@rev", cache_dir)
+    keys = [cache.key("a"), cache.key("b")]
+    cache.put_many(keys, np.ones((2, 3), dtype=np.float32))
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.ones(3, dtype=np.float32).tobytes())
+
+    reloaded = EmbeddingCache("model@rev", cache_dir)
+    assert len(reloaded) == 2
+    reloaded.put_many([reloaded.key("c")], np.full((1, 3), 2, dtype=np.float32))
+    np.testing.assert_array_equal(reloaded.get(reloaded.key("c")), [2, 2, 2])
+
+
+def test_repeated_keys_are_written_once(cache_dir):
+    cache = EmbeddingCache("model@rev", cache_dir)
+    tea, coffee, water = cache.key("tea"), cache.key("coffee"), cache.key("water")
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+    cache.put_many([tea, tea, coffee], vectors)
+    cache.put_many([coffee, water], vectors[:2] + 100)
+
+    for cache in (cache, EmbeddingCache("model@rev", cache_dir)):
+        assert len(cache) == 3 and len(cache.vectors) == 3
+        np.testing.assert_array_equal(cache.get(tea), vectors[0])
+        np.testing.assert_array_equal(cache.get(coffee), vectors[2])
+        np.testing.assert_array_equal(cache.get(water), vectors[1] + 100)
+
+
+def test_concurrent_gets_during_appends(cache_dir):
+    cache = EmbeddingCache("model@rev", cache_dir)
+    keys = [cache.key(str(i)) for i in range(400)]
+    vectors = np.arange(400 * 4, dtype=np.float32).reshape(400, 4)
+    errors = []
+
+    def read():
+        try:
+            for _ in range(20):
+                for i, key in enumerate(keys):
+                    vector = cache.get(key)
+                    if vector is not None:
+                        np.testing.assert_array_equal(vector, vectors[i])
+        except Exception as e:
+            errors.append(e)
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for i in range(0, 400, 4):
+        cache.put_many(keys[i : i + 4], vectors[i : i + 4])
+        cache.compact(keys[: i + 4 : 2])
+    for reader in readers:
+        reader.join()
+    assert errors == []
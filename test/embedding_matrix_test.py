@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.memory_utils.embedding_matrix import EmbeddingMatrix
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "embeddings.f32")
+
+
+def vectors(count, value=1.0):
+    return np.full((count, 4), value, dtype=np.float32)
+
+
+def test_clean_close_is_mapped_on_reopen(path):
+    matrix = EmbeddingMatrix(path=path)
+    matrix.append(vectors(3), labels=["a", "b", "c"])
+    matrix.close()
+
+    reopened = EmbeddingMatrix(path=path)
+    assert reopened.loaded and len(reopened) == 3
+    assert reopened.label(1) == "b"
+    reopened.close()
+
+
+def test_files_of_a_running_writer_are_left_alone(path):
+    writer = EmbeddingMatrix(path=path)
+    writer.append(vectors(3), labels=["a", "b", "c"])
+    size = os.path.getsize(path)
+
+    # Without the lock the second matrix neither maps nor deletes the files
+    other = EmbeddingMatrix(path=path)
+    assert not other.loaded and other.path is None
+    other.append(vectors(2, 2.0))
+    other.close()
+    assert os.path.getsize(path) == size
+
+    writer.close()
+    reopened = EmbeddingMatrix(path=path)
+    assert reopened.loaded and len(reopened) == 3
+    np.testing.assert_array_equal(reopened.view(), vectors(3))
+    reopened.close()
+
+
+def test_unclean_files_are_discarded(path):
+    matrix = EmbeddingMatrix(path=path)
+    matrix.append(vectors(3), labels=["a", "b", "c"])
+    # The OS drops the lock of a process that dies without close()
+    matrix.lock_file.close()
+
+    reopened = EmbeddingMatrix(path=path)
+    assert not reopened.loaded and len(reopened) == 0
+    reopened.close()
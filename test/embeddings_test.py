@@ -8,12 +8,13 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 logging.getLogger("xformers").setLevel(logging.ERROR)
 logging.getLogger("transformers.modeling_utils").setLevel(logging.ERROR)
 
-from src.memory_embeddings.stella_embeddings import StellaEmbeddings
+from src.memory_embeddings.embedder_factory import create_embedder
 
 
 @pytest.fixture
 def embedder():
-    return StellaEmbeddings()
+    # Uses the backend selected by MEMORY_EMBEDDER, e.g. stella-cpu on CPU-only hosts
+    return create_embedder()
 
 
 @pytest.fixture
@@ -62,3 +63,14 @@ def test_similarity(embedder, query, docs):
     avg_other_similarity = np.mean([similarities[i] for i in other_indices])
 
     assert avg_stress_similarity > avg_other_similarity
+
+
+def test_onnx_parity(docs):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("tokenizers")
+    from src.memory_embeddings.onnx_embeddings import parity_report
+
+    report = parity_report(
+        create_embedder("stella-cpu"), create_embedder("stella-onnx"), docs
+    )
+    assert report["passed"], report
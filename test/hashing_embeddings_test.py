@@ -0,0 +1,22 @@
+import numpy as np
+
+from src.memory_embeddings.hashing_embeddings import HashingEmbeddings
+
+
+def test_embeddings_are_deterministic():
+    docs = ["I like to go to the gym", "Green tea is healthy"]
+    np.testing.assert_array_equal(
+        HashingEmbeddings().embed_docs(docs), HashingEmbeddings().embed_docs(docs)
+    )
+
+
+def test_similarity_ranks_overlapping_text_first():
+    embedder = HashingEmbeddings()
+    docs = embedder.embed_docs(
+        ["I like to go to the gym", "Green tea is healthy", "Stress at work"]
+    )
+    query = embedder.embed_query("some green tea")
+    assert docs.shape == (3, embedder.dim)
+    assert embedder.similarity(query, docs, k=1) == [1]
+    indices, scores = embedder.similarity(query, docs, k=3, return_scores=True)
+    assert indices[0] == 1 and scores == sorted(scores, reverse=True)
@@ -0,0 +1,77 @@
+import pytest
+
+from src.memory_utils.memory_log_store import MemoryLogStore
+
+
+@pytest.fixture
+def file_path(tmp_path):
+    return str(tmp_path / "memories.yaml")
+
+
+def memory(memory_id, content):
+    return {"id": memory_id, "content": content, "tags": ["test"]}
+
+
+def test_replay_log(file_path):
+    store = MemoryLogStore(file_path)
+    assert store.load() == []
+    store.put(memory("a", "first"))
+    store.put(memory("b", "second"))
+    store.put(memory("a", "updated"))
+    store.sync(store.delete("b"))
+    store.close()
+
+    reloaded = MemoryLogStore(file_path)
+    assert reloaded.load() == [memory("a", "updated")]
+    reloaded.close()
+
+
+def test_snapshot_and_rotated_log_replay(file_path):
+    store = MemoryLogStore(file_path)
+    store.load()
+    store.put(memory("a", "first"))
+    store.rotate_log()
+    store.put(memory("b", "second"))
+    store.close()
+
+    # Crash before write_snapshot: the rotated log is still replayed
+    reloaded = MemoryLogStore(file_path)
+    memories = reloaded.load()
+    assert [m["id"] for m in memories] == ["a", "b"]
+
+    reloaded.rotate_log()
+    reloaded.write_snapshot(memories)
+    reloaded.close()
+
+    final = MemoryLogStore(file_path)
+    assert [m["id"] for m in final.load()] == ["a", "b"]
+    assert final.log_records == 0
+    final.close()
+
+
+def test_torn_record_is_dropped(file_path):
+    store = MemoryLogStore(file_path)
+    store.load()
+    store.sync(store.put(memory("a", "first")))
+    store.close()
+    with open(file_path + ".log", "a") as f:
+        f.write('{"op": "put", "memo')
+
+    reloaded = MemoryLogStore(file_path)
+    assert [m["id"] for m in reloaded.load()] == ["a"]
+    reloaded.sync(reloaded.put(memory("b", "second")))
+    reloaded.close()
+
+    assert [m["id"] for m in MemoryLogStore(file_path).load()] == ["a", "b"]
+
+
+def test_store_is_locked_while_open(file_path):
+    store = MemoryLogStore(file_path)
+    store.load()
+    with pytest.raises(RuntimeError, match="locked by another process"):
+        MemoryLogStore(file_path).load()
+    store.close()
+
+    reloaded = MemoryLogStore(file_path)
+    assert reloaded.load() == []
+    reloaded.close()
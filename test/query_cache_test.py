@@ -0,0 +1,61 @@
+import numpy as np
+
+from src.memory_embeddings import query_cache
+from src.memory_embeddings.query_cache import QueryEmbeddingCache
+
+
+def vector(value):
+    return np.full(4, value, dtype=np.float32)
+
+
+def test_key_normalizes_case_and_whitespace():
+    key = QueryEmbeddingCache.key
+    assert key("  Hello   World ", "query") == key("hello world", "query")
+    assert key("hello world", "query") != key("hello world", None)
+
+
+def test_evicts_least_recently_used():
+    cache = QueryEmbeddingCache(max_size=2)
+    cache.put("a", vector(1))
+    cache.put("b", vector(2))
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") is not None
+    cache.put("c", vector(3))
+
+    assert cache.get("b") is None
+    np.testing.assert_array_equal(cache.get("a"), vector(1))
+    np.testing.assert_array_equal(cache.get("c"), vector(3))
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(query_cache.time, "monotonic", lambda: now[0])
+    cache = QueryEmbeddingCache(ttl=10)
+    cache.put("a", vector(1))
+
+    now[0] += 9
+    assert cache.get("a") is not None
+    now[0] += 2
+    assert cache.get("a") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_counts_hits_and_misses():
+    cache = QueryEmbeddingCache(max_size=8)
+    assert cache.stats()["hit_rate"] == 0.0
+    cache.put("a", vector(1))
+    cache.get("a")
+    cache.get("a")
+    cache.get("b")
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == 2 / 3
+    assert stats["max_size"] == 8
+
+
+def test_cached_embeddings_are_read_only():
+    cache = QueryEmbeddingCache()
+    cache.put("a", vector(1))
+    assert not cache.get("a").flags.writeable
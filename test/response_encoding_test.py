@@ -0,0 +1,48 @@
+import pytest
+
+from src.memory_utils import response_encoding
+from src.memory_utils.response_encoding import decode, encode, parse_fields, project
+
+MEMORY = {
+    "id": "1",
+    "content": "Green tea is healthy",
+    "context": {"explanation": "Said by the user", "source": "chat"},
+    "metadata": {"length": 3},
+}
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields(["id, content", "context.explanation"]) == [
+        "id",
+        "content",
+        "context.explanation",
+    ]
+    assert parse_fields("id") == ["id"]
+
+
+def test_project_selects_nested_fields():
+    assert project(MEMORY, ["content", "context.explanation", "missing"]) == {
+        "content": "Green tea is healthy",
+        "context": {"explanation": "Said by the user"},
+    }
+    assert project(MEMORY, None) is MEMORY
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_json_round_trip(monkeypatch, use_orjson):
+    if use_orjson and not response_encoding.ORJSON_IMPORT_SUCCESS:
+        pytest.skip("orjson is not installed")
+    monkeypatch.setattr(response_encoding, "ORJSON_IMPORT_SUCCESS", use_orjson)
+    body = encode([MEMORY])
+    assert b" " not in body.replace(b"Green tea is healthy", b"").replace(
+        b"Said by the user", b""
+    )
+    assert decode(body) == [MEMORY]
+
+
+def test_msgpack_round_trip():
+    if not response_encoding.MSGPACK_IMPORT_SUCCESS:
+        pytest.skip("msgpack is not installed")
+    mimetype = response_encoding.MSGPACK_MIMETYPE
+    assert decode(encode([MEMORY], mimetype), mimetype) == [MEMORY]
@@ -0,0 +1,44 @@
+import numpy as np
+
+from src.memory_utils.segmented import SegmentedArray, SegmentedDict, SegmentedList
+
+
+def test_list_snapshot_is_isolated_from_writes():
+    values = SegmentedList(range(10), segment_size=4)
+    snapshot = values.snapshot()
+    values[5] = "changed"
+    values.append(10)
+
+    assert list(snapshot) == list(range(10))
+    assert list(values) == [0, 1, 2, 3, 4, "changed", *range(6, 11)]
+    # Only the written segments were copied
+    assert values.segments[0] is snapshot.segments[0]
+    assert values.segments[1] is not snapshot.segments[1]
+
+
+def test_dict_grows_and_keeps_snapshots():
+    values = SegmentedDict(((i, str(i)) for i in range(10)), segment_size=2)
+    snapshot = values.snapshot()
+    for i in range(10, 40):
+        values[i] = str(i)
+    assert values.pop(3) == "3"
+    assert values.pop(3) is None
+
+    assert len(values.segments) > len(snapshot.segments)
+    assert len(values) == 39 and 3 not in values
+    assert dict(values.items()) == {i: str(i) for i in range(40) if i != 3}
+    assert len(snapshot) == 10
+    assert dict(snapshot.items()) == {i: str(i) for i in range(10)}
+
+
+def test_array_view_and_growth():
+    values = SegmentedArray(np.int32, -1, values=[1, 2, 3], segment_size=4)
+    snapshot = values.snapshot()
+    values[9] = 7
+
+    assert values.get(100) == -1
+    np.testing.assert_array_equal(snapshot.view(), [1, 2, 3, -1])
+    np.testing.assert_array_equal(
+        values.view()[:10], [1, 2, 3, -1, -1, -1, -1, -1, -1, 7]
+    )
+    assert not values.view().flags.writeable
@@ -0,0 +1,547 @@
+import threading
+
+import numpy as np
+import pytest
+
+from src.memory_embeddings.hashing_embeddings import HashingEmbeddings
+from src.memory_utils.server_memory_manager import ServerMemoryManager
+
+
+@pytest.fixture
+def make_manager(tmp_path):
+    managers = []
+
+    def make(**kwargs):
+        manager = ServerMemoryManager(
+            file_path=str(tmp_path / "memories.yaml"),
+            cache_dir=str(tmp_path / "embedding_cache"),
+            embedder=HashingEmbeddings(),
+            **kwargs,
+        )
+        managers.append(manager)
+        return manager
+
+    yield make
+    for manager in managers:
+        manager.close()
+
+
+@pytest.fixture
+def manager(make_manager):
+    return make_manager()
+
+
+def memory_data(content, tags=None, **kwargs):
+    return {
+        "topic": content,
+        "content": content,
+        "tags": tags or [],
+        "context": {"explanation": ""},
+        **kwargs,
+    }
+
+
+def test_add_and_search(manager):
+    manager.add(memory_data("I like to go to the gym"))
+    manager.add(memory_data("Green tea is healthy"))
+    results = manager.search("green tea", k=1)
+    assert [memory["content"] for memory in results] == ["Green tea is healthy"]
+
+
+def test_update_and_delete(manager):
+    memory_id = manager.add(memory_data("I like to go to the gym"))
+    other_id = manager.add(memory_data("Green tea is healthy"))
+
+    assert manager.update(memory_id, {"content": "I like to go to the movies"})
+    assert manager.search("movies", k=1)[0]["id"] == memory_id
+
+    assert manager.delete(other_id)
+    assert not manager.delete(other_id)
+    assert [memory["id"] for memory in manager.search("green tea", k=5)] == [memory_id]
+
+
+def test_update_embeds_outside_write_lock(manager, monkeypatch):
+    memory_id = manager.add(memory_data("I like to go to the gym"))
+    embed_texts = manager.embed_texts
+    embedded = []
+
+    def embed_outside_lock(texts):
+        assert not manager.write_lock.locked()
+        embedded.extend(texts)
+        if len(embedded) == 1:
+            # A concurrent write changes the text while it is being embedded
+            assert manager.update(memory_id, {"topic": "Hobbies"})
+        return embed_texts(texts)
+
+    monkeypatch.setattr(manager, "embed_texts", embed_outside_lock)
+    assert manager.update(memory_id, {"content": "I like to go to the movies"})
+
+    [memory] = manager.memories
+    assert memory["topic"] == "Hobbies"
+    assert memory["content"] == "I like to go to the movies"
+    assert embedded[-1] == manager.get_embedding_text(memory)
+    assert manager.search("movies", k=1)[0]["id"] == memory_id
+
+
+def test_filter_by_tags(manager):
+    first = manager.add(memory_data("first", tags=["Music", "bands"]))
+    second = manager.add(memory_data("second", tags=["music"]))
+    assert [m["id"] for m in manager.filter_by_tags(["music"])] == [first, second]
+    assert [m["id"] for m in manager.filter_by_tags(["music", "bands"], "all")] == [
+        first
+    ]
+
+
+def test_filter_by_tags_lists_in_store_order(manager):
+    ids = manager.add_many(
+        [memory_data(f"Memory {i}", tags=["note"]) for i in range(3)]
+    )
+    # The deleted memory's slot is reused by the next add
+    manager.delete(ids[0])
+    new_id = manager.add(memory_data("Memory 3", tags=["note"]))
+
+    expected = [ids[1], ids[2], new_id]
+    assert [m["id"] for m in manager.filter_by_tags(["note"])] == expected
+    assert [m["id"] for m in manager.filter_by_tags([])] == expected
+    assert [m["id"] for m in manager.list_memories(tags=["note"])[0]] == expected
+
+
+def test_reload_restores_memories(make_manager):
+    manager = make_manager()
+    memory_id = manager.add(memory_data("Green tea is healthy"))
+    manager.add_many([memory_data("first"), memory_data("second")])
+    manager.delete(memory_id)
+    manager.close()
+
+    reloaded = make_manager()
+    assert sorted(memory["content"] for memory in reloaded.memories) == [
+        "first",
+        "second",
+    ]
+    assert reloaded.search("second", k=1)[0]["content"] == "second"
+
+
+def test_reload_keeps_store_order(make_manager):
+    manager = make_manager()
+    ids = manager.add_many([memory_data(f"Memory {i}") for i in range(3)])
+    # The deleted memory's slot is reused by the next add
+    manager.delete(ids[0])
+    new_id = manager.add(memory_data("Memory 3"))
+    manager.save()
+    manager.close()
+
+    reloaded = make_manager()
+    expected = [ids[1], ids[2], new_id]
+    assert [memory["id"] for memory in reloaded.memories] == expected
+    assert [memory["id"] for memory in reloaded.list_memories()[0]] == expected
+
+
+def test_add_many_with_repeated_text(manager):
+    first_id, second_id = manager.add_many(
+        [memory_data("green tea"), memory_data("green tea")]
+    )
+    # The second add reads the embedding the first one cached
+    coffee_ids = {manager.add(memory_data("black coffee")) for _ in range(2)}
+
+    results = manager.search("green tea", k=2)
+    assert {result["id"] for result in results} == {first_id, second_id}
+    assert results[0]["score"] == pytest.approx(results[1]["score"])
+    results = manager.search("black coffee", k=2)
+    assert {result["id"] for result in results} == coffee_ids
+    assert results[0]["score"] == pytest.approx(results[1]["score"])
+
+
+def test_search_batch_merges_duplicates(manager):
+    manager.add_many([memory_data("green tea"), memory_data("black tea")])
+    response = manager.search_batch(["green tea", "tea"], k=2, merge=True)
+    assert [len(results) for results in response["results"]] == [2, 2]
+    assert len(response["merged"]) == 2
+
+
+def test_async_embedding_becomes_searchable(make_manager):
+    manager = make_manager(async_embedding=True, vector_index="exact")
+    memory_ids = manager.add_many(
+        [memory_data("the cat sat on the mat"), memory_data("stock prices fell")]
+    )
+    assert all(manager.memory_status(i) in ("pending", "ready") for i in memory_ids)
+
+    manager.wait_for_embeddings()
+    assert [manager.memory_status(i) for i in memory_ids] == ["ready", "ready"]
+    assert manager.search("cat on a mat", k=1)[0]["id"] == memory_ids[0]
+    assert manager.memory_status("missing") is None
+
+
+def test_delete_pending_memory(make_manager, monkeypatch):
+    manager = make_manager(async_embedding=True, vector_index="exact")
+    embedding_started = threading.Event()
+    release = threading.Event()
+    embed_texts = manager.embed_texts
+
+    def blocked_embed_texts(texts):
+        embedding_started.set()
+        release.wait()
+        return embed_texts(texts)
+
+    monkeypatch.setattr(manager, "embed_texts", blocked_embed_texts)
+    memory_id = manager.add(memory_data("the cat sat on the mat"))
+    embedding_started.wait()
+    try:
+        assert manager.memory_status(memory_id) == "pending"
+        assert manager.delete(memory_id)
+    finally:
+        release.set()
+    manager.wait_for_embeddings()
+    assert manager.memory_status(memory_id) is None
+    assert manager.search("cat", k=1) == []
+
+
+def test_failed_embeddings_are_retried_then_reported(make_manager, monkeypatch):
+    manager = make_manager(
+        async_embedding=True, vector_index="exact", embedding_retries=1
+    )
+    embed_texts = manager.embed_texts
+    failures = []
+
+    def failing_embed_texts(texts):
+        if len(failures) < failures_allowed:
+            failures.append(texts)
+            raise RuntimeError("model unavailable")
+        return embed_texts(texts)
+
+    monkeypatch.setattr(manager, "embed_texts", failing_embed_texts)
+    failures_allowed = 1
+    retried_id = manager.add(memory_data("the cat sat on the mat"))
+    manager.wait_for_embeddings()
+    assert manager.memory_status(retried_id) == "ready"
+
+    failures_allowed = 3
+    failed_id = manager.add(memory_data("stock prices fell"))
+    manager.wait_for_embeddings()
+    assert len(failures) == 3
+    assert manager.memory_status(failed_id) == "failed"
+    assert manager.search("stock prices", k=1, mode="lexical")[0]["id"] == failed_id
+
+    # An update that changes the text embeds it again
+    manager.update(failed_id, {"content": "stock prices rose"})
+    assert manager.memory_status(failed_id) == "ready"
+
+
+def test_failed_mutation_is_rolled_back(manager, monkeypatch):
+    kept_id = manager.add(memory_data("green tea is healthy"))
+    deleted_id = manager.add(memory_data("black coffee is bitter"))
+    manager.delete(deleted_id)
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(manager.store, "put_many", fail)
+    with pytest.raises(OSError):
+        manager.add(memory_data("oolong tea"))
+    monkeypatch.setattr(manager.store, "delete", fail)
+    with pytest.raises(OSError):
+        manager.delete(kept_id)
+    monkeypatch.undo()
+
+    assert [memory["id"] for memory in manager.memories] == [kept_id]
+    assert manager.memory_count == 1
+    assert manager.search("tea", k=5)[0]["id"] == kept_id
+    assert manager.search("tea", k=5, mode="lexical")[0]["id"] == kept_id
+    new_id = manager.add(memory_data("oolong tea"))
+    assert manager.search("oolong tea", k=1)[0]["id"] == new_id
+    assert manager.memory_count == 2
+
+
+def test_coalesced_searches_match_direct_searches(make_manager):
+    from concurrent.futures import ThreadPoolExecutor
+
+    manager = make_manager(coalesce_searches=True, vector_index="exact")
+    manager.add_many(
+        [memory_data(text) for text in ("red apples", "green pears", "blue sky")]
+    )
+    queries = ["red apples", "green pears", "blue sky", "red apples"]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda q: manager.search(q, k=1), queries))
+    assert [result[0]["content"] for result in results] == queries
+
+
+def test_read_snapshot_is_isolated_from_writes(manager):
+    old_id = manager.add(memory_data("the cat sat on the mat"))
+    with manager.snapshots.read() as snapshot:
+        manager.delete(old_id)
+        # The retired slot is not reused while the snapshot is held
+        new_id = manager.add(memory_data("stock prices fell"))
+        assert manager.id_to_slot[new_id] != snapshot.id_to_slot[old_id]
+        slots, _ = snapshot.vector_index.search(
+            manager.embed_queries(["cat on a mat"])[0], 1
+        )
+        assert snapshot.slots[slots[0]]["id"] == old_id
+    assert [memory["id"] for memory in manager.memories] == [new_id]
+
+
+def test_concurrent_writes_and_searches(make_manager):
+    manager = make_manager(vector_index="exact")
+    stop = threading.Event()
+    errors = []
+
+    def write():
+        for i in range(100):
+            memory_id = manager.add(memory_data(f"note {i}"))
+            manager.update(memory_id, {"content": f"edited note {i}"})
+            if i % 2:
+                manager.delete(memory_id)
+        stop.set()
+
+    def search():
+        try:
+            while not stop.is_set():
+                for memory in manager.search("edited note", k=5):
+                    assert memory["content"] in (
+                        memory["topic"],
+                        f"edited {memory['topic']}",
+                    )
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + [
+        threading.Thread(target=search) for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert len(manager.memories) == 50
+
+
+def test_sqlite_storage_persists_memories(make_manager, monkeypatch):
+    manager = make_manager(storage="sqlite")
+    memory_id = manager.add(memory_data("the cat sat on the mat", tags=["pets"]))
+    manager.update(memory_id, {"content": "the dog sat on the mat"})
+    manager.close()
+
+    # Without a storage argument the manager uses MEMORY_STORAGE
+    monkeypatch.setenv("MEMORY_STORAGE", "sqlite")
+    reloaded = make_manager()
+    assert [memory["content"] for memory in reloaded.memories] == [
+        "the dog sat on the mat"
+    ]
+    assert reloaded.search("dog", k=1)[0]["id"] == memory_id
+
+
+def test_mmap_embeddings_are_reused_after_clean_close(make_manager):
+    manager = make_manager(mmap_embeddings=True)
+    kept_id = manager.add(memory_data("the cat sat on the mat"))
+    deleted_id = manager.add(memory_data("stock prices fell"))
+    manager.delete(deleted_id)
+    manager.close()
+
+    reloaded = make_manager(mmap_embeddings=True)
+    assert reloaded.embeddings.loaded
+    assert isinstance(reloaded.embeddings.buffer, np.memmap)
+    assert reloaded.search("cat", k=1)[0]["id"] == kept_id
+    assert reloaded.id_to_slot[kept_id] == manager.id_to_slot[kept_id]
+    assert reloaded.add(memory_data("dogs bark")) is not None
+
+
+def test_mmap_embeddings_are_rebuilt_after_crash(make_manager):
+    manager = make_manager(mmap_embeddings=True)
+    memory_id = manager.add(memory_data("the cat sat on the mat"))
+    # No manager.close(), as after a crash, where the OS drops the locks
+    manager.store.close()
+    manager.embeddings.lock_file.close()
+
+    reloaded = make_manager(mmap_embeddings=True)
+    assert not reloaded.embeddings.loaded
+    assert reloaded.search("cat", k=1)[0]["id"] == memory_id
+
+
+def test_quantized_vector_index(make_manager):
+    manager = make_manager(vector_index="int8")
+    memory_ids = manager.add_many(
+        [memory_data(text) for text in ("red apples", "green pears", "blue sky")]
+    )
+    assert manager.search("green pears", k=1)[0]["id"] == memory_ids[1]
+    assert manager.measure_recall(k=2) == 1.0
+
+
+def test_ivf_trains_outside_write_lock(make_manager, monkeypatch):
+    manager = make_manager(vector_index_params={"min_train_size": 20})
+    memory_ids = manager.add_many([memory_data(f"note {i}") for i in range(30)])
+    fit = manager.snapshots.current.vector_index.fit
+
+    def fit_unlocked():
+        assert not manager.write_lock.locked()
+        return fit()
+
+    monkeypatch.setattr(manager.snapshots.current.vector_index, "fit", fit_unlocked)
+    manager.train_vector_index()
+    assert manager.vector_index.ivf is not None
+    assert manager.snapshots.current.vector_index.ivf is not None
+    assert manager.search("note 7", k=1)[0]["id"] == memory_ids[7]
+
+
+def test_lexical_and_hybrid_search(make_manager):
+    manager = make_manager(vector_index="exact")
+    band_id, _ = manager.add_many(
+        [
+            memory_data("User loves Radiohead", tags=["music"]),
+            memory_data("User dislikes rain"),
+        ]
+    )
+    manager.embedder.embed_queries = None  # lexical search must not run the model
+    assert [m["id"] for m in manager.search("radiohead", k=5, mode="lexical")] == [
+        band_id
+    ]
+    del manager.embedder.embed_queries
+
+    assert manager.search("radiohead", k=1, mode="hybrid")[0]["id"] == band_id
+    with pytest.raises(ValueError):
+        manager.search("radiohead", mode="fuzzy")
+
+
+@pytest.mark.parametrize("mode", ["vector", "lexical", "hybrid"])
+def test_filtered_search(make_manager, mode):
+    manager = make_manager(coalesce_searches=True)
+    ada_id, bob_id, _ = manager.add_many(
+        [
+            memory_data("Green tea is healthy", ai_persona="Ada", importance=0.9),
+            memory_data("Green tea is tasty", ai_persona="Bob", importance=0.9),
+            memory_data("Green tea is cheap", ai_persona="Ada", importance=0.1),
+        ]
+    )
+    filters = {"ai_persona": "Ada", "min_importance": 0.5}
+    results = manager.search("green tea", k=5, mode=mode, filters=filters)
+    assert [memory["id"] for memory in results] == [ada_id]
+
+    manager.update(bob_id, {"ai_persona": "Ada"})
+    results = manager.search_batch(["green tea"], k=5, mode=mode, filters=filters)
+    assert sorted(memory["id"] for memory in results["results"][0]) == sorted(
+        [ada_id, bob_id]
+    )
+    assert manager.search("green tea", mode=mode, filters={"ai_persona": "Eve"}) == []
+
+
+def test_list_memories_pages_in_store_order(manager):
+    ids = manager.add_many(
+        [
+            memory_data(f"Memory {i}", tags=["even" if i % 2 == 0 else "odd"])
+            for i in range(7)
+        ]
+    )
+    manager.delete(ids[3])
+
+    pages, cursor = [], 0
+    while cursor is not None:
+        memories, cursor = manager.list_memories(cursor=cursor, limit=2)
+        pages.append([memory["id"] for memory in memories])
+    assert pages == [ids[0:2], [ids[2], ids[4]], ids[5:7]]
+
+    memories, cursor = manager.list_memories(tags=["even"], limit=10)
+    assert [memory["id"] for memory in memories] == ids[0::2] and cursor is None
+    assert [memory["id"] for memory in manager.iter_memories(page_size=2)] == [
+        memory_id for memory_id in ids if memory_id != ids[3]
+    ]
+    assert manager.memory_count == 6
+
+
+def test_list_memories_cursor_survives_moves_and_reuse(manager):
+    ids = manager.add_many([memory_data(f"Memory {i}") for i in range(6)])
+
+    first_page, cursor = manager.list_memories(limit=3)
+    # Re-embedding moves a memory to a new slot, and the deleted memory's
+    # slot is reused by the next add
+    manager.update(ids[1], {"content": "Memory 1, revised"})
+    manager.delete(ids[0])
+    new_id = manager.add(memory_data("Memory 6"))
+    second_page, cursor = manager.list_memories(cursor=cursor, limit=3)
+    third_page, cursor = manager.list_memories(cursor=cursor, limit=3)
+
+    assert [memory["id"] for memory in first_page] == ids[0:3]
+    assert [memory["id"] for memory in second_page] == ids[3:6]
+    assert [memory["id"] for memory in third_page] == [new_id] and cursor is None
+
+
+def test_search_scores_and_cutoffs(manager):
+    manager.add_many(
+        [
+            memory_data("Green tea is healthy"),
+            memory_data("Green tea is tasty"),
+            memory_data("The gym opens at six"),
+        ]
+    )
+    results = manager.search("green tea", k=3)
+    scores = [memory["score"] for memory in results]
+    assert len(results) == 3 and scores == sorted(scores, reverse=True)
+    assert "score" not in manager.memories[0]
+
+    strong = [memory for memory in results if memory["score"] >= 0.3]
+    assert 0 < len(strong) < 3
+    assert manager.search("green tea", k=3, min_score=0.3) == strong
+    relative = manager.search("green tea", k=3, min_relative_score=0.99)
+    assert relative[0] == results[0] and len(relative) < 3
+
+    batch = manager.search_batch(["green tea", "gym"], k=3, merge=True, min_score=0.3)
+    assert batch["results"][0] == strong
+    assert all(memory["score"] >= 0.3 for memory in batch["merged"])
+
+
+def test_weighted_reranking(make_manager):
+    manager = make_manager(vector_index="exact")
+    tasty_id, healthy_id = manager.add_many(
+        [
+            memory_data("Green tea is tasty", importance=0.1),
+            memory_data("Green tea is healthy and cheap", importance=1.0),
+        ]
+    )
+    assert manager.search("green tea tasty", k=1)[0]["id"] == tasty_id
+    result = manager.search("green tea tasty", k=1, weights={"importance": 1.0})[0]
+    assert result["id"] == healthy_id and result["score"] > 1.0
+
+    manager.score_weights = {"importance": 1.0}
+    assert manager.search("green tea tasty", k=1)[0]["id"] == healthy_id
+    assert manager.search("green tea tasty", k=1, weights={})[0]["id"] == tasty_id
+
+
+def test_weighted_reranking_normalizes_fused_scores(make_manager):
+    manager = make_manager(vector_index="exact")
+    tea_id, _ = manager.add_many(
+        [
+            memory_data("Green tea is tasty", importance=0.5),
+            memory_data("Stock prices fell sharply", importance=0.6),
+        ]
+    )
+    # Raw fused scores are too small to outweigh a 0.1 importance gap
+    results = manager.search(
+        "green tea tasty", k=2, mode="hybrid", weights={"importance": 0.5}
+    )
+    assert results[0]["id"] == tea_id
+    assert results[0]["score"] == pytest.approx(1.25)
+
+    results = manager.search(
+        "green tea tasty", k=2, mode="lexical", weights={"importance": 0.5}
+    )
+    assert [result["score"] for result in results] == [pytest.approx(1.25)]
+
+
+def test_access_stats_are_flushed_in_batches(make_manager):
+    manager = make_manager(track_access=True)
+    tea_id, gym_id = manager.add_many(
+        [memory_data("Green tea is healthy"), memory_data("I like the gym")]
+    )
+    manager.search("green tea", k=1)
+    manager.search_batch(["green tea", "tea"], k=1)
+    # Searches only count hits until the next flush
+    assert manager.memories[0]["access_count"] == 0
+    assert manager.flush_access_stats() == 1
+    assert manager.flush_access_stats() == 0
+
+    memories = {memory["id"]: memory for memory in manager.memories}
+    assert memories[tea_id]["access_count"] == 3
+    assert memories[gym_id]["access_count"] == 0
+    assert memories[tea_id]["last_accessed"] > memories[gym_id]["last_accessed"]
+
+    manager.search("green tea", k=1)
+    manager.close()
+    reloaded = make_manager()
+    memories = {memory["id"]: memory for memory in reloaded.memories}
+    assert memories[tea_id]["access_count"] == 4
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from src.memory_utils.memory_log_store import MemoryLogStore
+from src.memory_utils.sqlite_memory_store import SqliteEmbeddingCache, SqliteMemoryStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "memories.db")
+
+
+def memory(memory_id, content, tags=("test",)):
+    return {"id": memory_id, "content": content, "tags": list(tags)}
+
+
+def tag_rows(store):
+    return sorted(store.connection.execute("SELECT tag, memory_id FROM memory_tags"))
+
+
+def test_put_delete_and_reload(db_path):
+    store = SqliteMemoryStore(db_path)
+    assert store.load() == []
+    store.put_many([memory("a", "first"), memory("b", "second")])
+    store.put(memory("a", "updated", tags=["Some_Tag"]))
+    store.delete("b")
+    assert tag_rows(store) == [("some tag", "a")]
+    store.close()
+
+    reloaded = SqliteMemoryStore(db_path)
+    assert reloaded.load() == [memory("a", "updated", tags=["Some_Tag"])]
+    reloaded.close()
+
+
+def test_migrates_yaml_store_once(tmp_path, db_path):
+    yaml_path = str(tmp_path / "memories.yaml")
+    yaml_store = MemoryLogStore(yaml_path)
+    yaml_store.load()
+    yaml_store.put(memory("a", "first"))
+    yaml_store.close()
+
+    store = SqliteMemoryStore(db_path, migrate_from=yaml_path)
+    assert store.load() == [memory("a", "first")]
+    store.delete("a")
+    store.close()
+
+    reloaded = SqliteMemoryStore(db_path, migrate_from=yaml_path)
+    assert reloaded.load() == []
+    reloaded.close()
+
+
+def test_embedding_cache_round_trip(db_path):
+    cache = SqliteEmbeddingCache("model@rev", db_path)
+    keys = [cache.key("first"), cache.key("second")]
+    vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+    cache.put_many(keys, vectors)
+
+    reloaded = SqliteEmbeddingCache("model@rev", db_path)
+    assert len(reloaded) == 2 and reloaded.dim == 4
+    np.testing.assert_array_equal(reloaded.get(keys[1]), vectors[1])
+    assert reloaded.get(reloaded.key("third")) is None
+
+    reloaded.compact([keys[0]], max_dead_ratio=0.0)
+    assert len(reloaded) == 1
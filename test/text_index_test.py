@@ -0,0 +1,53 @@
+import numpy as np
+
+from src.memory_utils.text_index import TextIndex, reciprocal_rank_fusion, tokenize
+
+
+def test_tokenize():
+    assert tokenize("Radiohead's OK_Computer, 1997!") == [
+        "radiohead",
+        "s",
+        "ok_computer",
+        "1997",
+    ]
+
+
+def test_bm25_ranks_rare_terms_higher():
+    index = TextIndex()
+    index.add(0, "I like the band Radiohead")
+    index.add(1, "I like the weather")
+    index.add(2, "I like the beach and the weather")
+    slots, scores = index.search("radiohead weather", 3)
+    assert slots[0] == 0
+    assert list(scores) == sorted(scores, reverse=True)
+    assert index.search("unknown", 3)[0].size == 0
+
+
+def test_snapshot_ignores_later_changes():
+    index = TextIndex()
+    index.add(0, "green tea")
+    snapshot = index.snapshot()
+    index.remove(0)
+    index.add(1, "green tea with honey")
+    assert snapshot.search("green", 5)[0].tolist() == [0]
+    assert index.search("green", 5)[0].tolist() == [1]
+    assert len(snapshot) == 1 and len(index) == 1
+
+
+def test_writes_copy_only_changed_segments():
+    index = TextIndex(segment_size=2)
+    for slot in range(6):
+        index.add(slot, "green tea")
+    snapshot = index.snapshot()
+    index.remove(0)
+
+    assert sorted(snapshot.search("tea", 10)[0].tolist()) == list(range(6))
+    assert sorted(index.search("tea", 10)[0].tolist()) == list(range(1, 6))
+    assert index.postings["tea"][0] is not snapshot.postings["tea"][0]
+    assert index.postings["tea"][1] is snapshot.postings["tea"][1]
+    assert (len(snapshot), len(index)) == (6, 5)
+
+
+def test_reciprocal_rank_fusion():
+    slots, _ = reciprocal_rank_fusion([np.array([1, 2, 3]), np.array([3, 1, 4])], 2)
+    assert slots.tolist() == [1, 3]
@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+
+from src.memory_embeddings.base_embeddings import normalize
+from src.memory_utils.embedding_matrix import EmbeddingMatrix
+from src.memory_utils.vector_index import (
+    ExactIndex,
+    IVFIndex,
+    MatryoshkaIndex,
+    QuantizedIndex,
+    measure_recall,
+)
+
+
+@pytest.fixture
+def embeddings():
+    rng = np.random.default_rng(42)
+    # Clustered data, as real embeddings are, so that IVF buckets are meaningful
+    centers = rng.normal(size=(32, 64))
+    vectors = centers[rng.integers(0, 32, size=5000)] + 0.3 * rng.normal(
+        size=(5000, 64)
+    )
+    return EmbeddingMatrix(normalize(vectors))
+
+
+@pytest.fixture
+def queries():
+    return normalize(np.random.default_rng(7).normal(size=(20, 64)))
+
+
+def build(index):
+    for slot in range(len(index.embeddings)):
+        index.add(slot)
+    if index.needs_training():
+        index.train()
+    return index
+
+
+def test_exact_index_skips_removed_rows(embeddings, queries):
+    index = build(ExactIndex(embeddings))
+    slots, scores = index.search(queries[0], 5)
+    assert list(scores) == sorted(scores, reverse=True)
+
+    index.remove(int(slots[0]))
+    assert slots[0] not in index.search(queries[0], 5)[0]
+
+
+def test_ivf_recall(embeddings, queries):
+    exact = build(ExactIndex(embeddings))
+    ivf = build(IVFIndex(embeddings, nprobe=16, min_train_size=1000))
+    assert ivf.ivf is not None
+
+    hits = 0
+    for query in queries:
+        expected = set(exact.search(query, 10)[0].tolist())
+        hits += len(expected & set(ivf.search(query, 10)[0].tolist()))
+    assert hits / (10 * len(queries)) >= 0.8
+
+
+def test_ivf_incremental_add_and_remove(embeddings, queries):
+    ivf = build(IVFIndex(embeddings, min_train_size=1000))
+    slot = embeddings.append(queries[0])
+    ivf.add(slot)
+    assert ivf.search(queries[0], 1)[0][0] == slot
+
+    ivf.remove(slot)
+    assert slot not in ivf.search(queries[0], 10)[0]
+
+
+def test_ivf_installs_training_of_a_snapshot(embeddings, queries):
+    ivf = IVFIndex(embeddings, min_train_size=1000)
+    for slot in range(len(embeddings) - 1):
+        ivf.add(slot)
+    snapshot = ivf.snapshot()
+    # Rows added and removed while the snapshot trains are caught up on install
+    added = len(embeddings) - 1
+    ivf.add(added)
+    ivf.remove(0)
+    trained = snapshot.fit()
+    assert snapshot.ivf is None
+
+    ivf.install(trained)
+    centroids, lists, assignments = ivf.ivf
+    assert sum(len(bucket) for bucket in lists) == len(ivf) == len(embeddings) - 1
+    assert added in lists[assignments.get(added)] and assignments.get(0) == -1
+    assert ivf.search(embeddings.view()[added], 1)[0][0] == added
+
+
+def test_ivf_falls_back_to_exact_for_small_stores(embeddings, queries):
+    ivf = build(IVFIndex(embeddings, min_train_size=100000))
+    assert ivf.ivf is None
+    np.testing.assert_array_equal(
+        ivf.search(queries[0], 10)[0],
+        build(ExactIndex(embeddings)).search(queries[0], 10)[0],
+    )
+
+
+def test_search_batch_matches_single_searches(embeddings, queries):
+    for index in (
+        build(ExactIndex(embeddings)),
+        build(IVFIndex(embeddings, min_train_size=1000)),
+    ):
+        for query, (slots, scores) in zip(queries, index.search_batch(queries, 5)):
+            expected_slots, expected_scores = index.search(query, 5)
+            np.testing.assert_array_equal(slots, expected_slots)
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "make_index",
+    [ExactIndex, lambda embeddings: IVFIndex(embeddings, min_train_size=1000)],
+)
+def test_snapshot_ignores_later_changes(embeddings, queries, make_index):
+    index = build(make_index(embeddings))
+    snapshot = index.snapshot()
+    expected = snapshot.search(queries[0], 5)
+
+    index.remove(int(expected[0][0]))
+    index.add(embeddings.append(queries[0]))
+    slots, scores = snapshot.search(queries[0], 5)
+    np.testing.assert_array_equal(slots, expected[0])
+    np.testing.assert_array_equal(scores, expected[1])
+
+
+@pytest.mark.parametrize(
+    "mode, rescore_factor", [("float16", 4), ("int8", 4), ("binary", 16)]
+)
+def test_quantized_index_recall(embeddings, queries, mode, rescore_factor):
+    index = build(QuantizedIndex(embeddings, mode=mode, rescore_factor=rescore_factor))
+    if mode == "binary":
+        # Sign bits of only 64 dimensions need a long shortlist near the data
+        assert measure_recall(index, embeddings.view()[:20], 10) >= 0.8
+    else:
+        assert measure_recall(index, queries, 10) >= 0.95
+
+    slots, scores = index.search(queries[0], 5)
+    np.testing.assert_allclose(scores, embeddings.view()[slots] @ queries[0], rtol=1e-5)
+    index.remove(int(slots[0]))
+    assert slots[0] not in index.search(queries[0], 5)[0]
+
+
+def test_matryoshka_index_rescores_with_full_vectors():
+    # Like Matryoshka embeddings, most of the signal is in the leading dimensions
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(5000, 64)) * np.geomspace(1, 0.05, 64)
+    embeddings = EmbeddingMatrix(normalize(vectors))
+    queries = embeddings.view()[:20]
+
+    index = build(MatryoshkaIndex(embeddings, dims=16, rescore_factor=8))
+    assert index.codes.shape[1] == 16
+    assert measure_recall(index, queries, 10) >= 0.9
+
+    slots, scores = index.search(queries[0], 5)
+    np.testing.assert_allclose(scores, embeddings.view()[slots] @ queries[0], rtol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "make_index",
+    [
+        ExactIndex,
+        lambda embeddings: IVFIndex(embeddings, min_train_size=1000),
+        lambda embeddings: QuantizedIndex(embeddings, mode="int8"),
+    ],
+)
+def test_masked_search_only_returns_selected_rows(embeddings, queries, make_index):
+    index = build(make_index(embeddings))
+    exact = build(ExactIndex(embeddings))
+    mask = np.zeros(len(embeddings), dtype=bool)
+    mask[::50] = True
+    for (slots, _), (expected, _) in zip(
+        index.search_batch(queries, 5, mask=mask),
+        exact.search_batch(queries, 5, mask=mask),
+    ):
+        assert mask[slots].all()
+        # Selective masks are scanned exactly, even by the IVF index
+        assert slots.tolist() == expected.tolist()
+    slots, _ = index.search(queries[0], 5, mask=mask[:100])
+    assert set(slots.tolist()) <= {0, 50}